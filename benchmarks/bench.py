@@ -0,0 +1,189 @@
+"""Measures the throughput of mutagenwrapper against raw mutagen on
+a synthetic corpus (see corpus.py). Usage::
+
+    $ python benchmarks/bench.py [--corpus DIR] [--json FILE] [--compare FILE]
+
+The corpus is generated in a temporary directory unless *--corpus* is
+given. Files in the corpus are modified by the save benchmark.
+Results are reported in microseconds per file for each variant and
+format; ``raw`` is the time taken by mutagen alone where there is an
+equivalent operation, and ``ratio`` is the overhead of the wrapper.
+
+With *--compare*, results are compared with those saved by *--json* in an
+earlier run, and the exit status is 1 if any operation got slower by more
+than *--threshold*.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import corpus
+from mutagenwrapper import MediaFile, get_format
+from mutagenwrapper.bases import _find_handler
+
+
+fields = ['artist', 'title', 'album', 'date', 'genre', 'composer',
+          'tracknumber', 'tracktotal', 'discnumber', 'disctotal']
+
+
+def best_of(func, args, repeat):
+    """Returns the shortest time of *repeat* runs of *func* over *args*,
+    in microseconds per call.
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for arg in args:
+            func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e6 / len(args)
+
+
+def read_fields(m):
+    for field in fields:
+        getattr(m, field)
+
+
+def raw_read_fields(names):
+    def func(raw):
+        for name in names:
+            raw.get(name)
+    return func
+
+
+def iterate(m):
+    list(m.iteritems())
+
+
+def raw_iterate(raw):
+    list(raw.tags.items())
+
+
+def write_fields(m):
+    m.title = u'Benchmark'
+    m.tracknumber = 3
+    m['___bench'] = u'value'
+
+
+def save(m):
+    m.title = u'Saved'
+    m.save()
+
+
+def raw_save(raw):
+    raw.save()
+
+
+def bench_group(paths, extension, repeat):
+    """Returns a dict of operation -> (wrapper time, raw time or None)."""
+    format = get_format(extension)
+    raw_class = format.raw_classes[extension]
+    wrapper_class = format.wrapper_class
+    names = [getattr(_find_handler(wrapper_class, f), 'name', f)
+             for f in fields]
+    results = {}
+    results['open'] = (best_of(MediaFile, paths, repeat),
+                       best_of(raw_class, paths, repeat))
+    results['open_tags_only'] = (
+        best_of(lambda p: MediaFile(p, tags_only=True), paths, repeat), None)
+    media = [MediaFile(p) for p in paths]
+    raws = [m.raw for m in media]
+    results['read'] = (best_of(read_fields, media, repeat),
+                       best_of(raw_read_fields(names), raws, repeat))
+    results['iterate'] = (best_of(iterate, media, repeat),
+                          best_of(raw_iterate, raws, repeat))
+    results['write'] = (best_of(write_fields, media, repeat), None)
+    results['save'] = (best_of(save, media, repeat),
+                       best_of(raw_save, raws, repeat))
+    return results
+
+
+def run(root, repeat):
+    groups = defaultdict(list)
+    for variant in corpus.variants:
+        subdir = os.path.join(root, variant)
+        for name in sorted(os.listdir(subdir)):
+            extension = name.rsplit('.', 1)[-1]
+            groups[variant, extension].append(os.path.join(subdir, name))
+    results = {}
+    for (variant, extension), paths in sorted(groups.iteritems()):
+        for op, times in bench_group(paths, extension, repeat).iteritems():
+            results['{}/{}/{}'.format(variant, extension, op)] = times
+    return results
+
+
+def report(results, baseline=None):
+    header = '{:<28} {:>12} {:>12} {:>7}'.format('benchmark', 'wrapper',
+                                                 'raw', 'ratio')
+    if baseline is not None:
+        header += ' {:>9}'.format('vs base')
+    print header
+    for key in sorted(results):
+        wrapper, raw = results[key]
+        line = '{:<28} {:>12.1f} {:>12} {:>7}'.format(
+            key, wrapper,
+            '{:.1f}'.format(raw) if raw is not None else '-',
+            '{:.2f}'.format(wrapper / raw) if raw else '-')
+        if baseline is not None and key in baseline:
+            line += ' {:>8.2f}x'.format(wrapper / baseline[key][0])
+        print line
+
+
+def regressions(results, baseline, threshold):
+    """Returns the keys of the benchmarks that got slower than *baseline*
+    by more than *threshold*, e.g. 0.1 for 10%.
+    """
+    return [key for key in sorted(results) if key in baseline and
+            results[key][0] > baseline[key][0] * (1 + threshold)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmarks')
+    parser.add_argument('--corpus', help='corpus directory (generated '
+                        'in a temporary directory if not given)')
+    parser.add_argument('--count', type=int, default=10,
+                        help='copies of each file when generating the corpus')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='save the results to a file')
+    parser.add_argument('--compare', help='compare with saved results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+    tmpdir = None
+    root = args.corpus
+    if root is None:
+        tmpdir = root = tempfile.mkdtemp(prefix='mutagenwrapper-bench-')
+        corpus.generate(root, args.count)
+    try:
+        results = run(root, args.repeat)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print '\nRegressions: ' + ', '.join(slower)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Generates a synthetic corpus for the benchmarks from the seed files in
+tests/data. Usage::
+
+    $ python benchmarks/corpus.py OUTPUT_DIR [--count N] [--cover-size BYTES]
+
+Each seed is written in the following variants, *count* copies each, under
+OUTPUT_DIR/<variant>/:
+
+- ``basic``: the seed as is
+- ``custom``: with 200 custom (TXXX, freeform or Vorbis comment) tags
+- ``cover``: with a large front cover
+- ``multi``: with multi-value artist, genre and composer fields
+
+"""
+import argparse
+import base64
+import os
+import shutil
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import mutagen.flac
+import mutagen.id3
+import mutagen.mp4
+
+from mutagenwrapper import MediaFile
+
+
+data_dir = os.path.join(os.path.dirname(here), 'tests', 'data')
+seeds = ['lame.mp3', 'alac.m4a', 'flac.flac', 'oggvorbis.ogg']
+variants = ['basic', 'custom', 'cover', 'multi']
+
+
+def make_cover(size):
+    """Returns JPEG data of *size* bytes, padded after the end of image."""
+    with open(os.path.join(data_dir, 'purple.jpg'), 'rb') as f:
+        data = f.read()
+    return data + os.urandom(max(0, size - len(data)))
+
+
+def add_custom(m, n=200):
+    for i in xrange(n):
+        m['___custom{:03d}'.format(i)] = u'value {}'.format(i)
+
+
+def add_cover(m, data):
+    raw = m.raw
+    if m.extension == 'mp3':
+        raw.tags.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3,
+                                      desc=u'', data=data))
+    elif m.extension == 'm4a':
+        raw['covr'] = [mutagen.mp4.MP4Cover(data)]
+    else:
+        picture = mutagen.flac.Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.width = picture.height = 100
+        picture.data = data
+        if m.extension == 'flac':
+            raw.add_picture(picture)
+        else:
+            raw['metadata_block_picture'] = [
+                base64.b64encode(picture.write())]
+
+
+def add_multi(m, n=20):
+    m.artist = [u'Artist {}'.format(i) for i in xrange(n)]
+    m.genre = [u'Genre {}'.format(i) for i in xrange(n)]
+    m.composer = [u'Composer {}'.format(i) for i in xrange(n)]
+
+
+def generate(output, count=10, cover_size=2 * 1024 * 1024):
+    """Writes the corpus to *output* and returns the list of paths."""
+    cover = make_cover(cover_size)
+    paths = []
+    for variant in variants:
+        subdir = os.path.join(output, variant)
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        for seed in seeds:
+            name, ext = seed.rsplit('.', 1)
+            template = os.path.join(subdir, '{}_0.{}'.format(name, ext))
+            shutil.copy(os.path.join(data_dir, '1_basic_' + seed), template)
+            m = MediaFile(template)
+            if variant == 'custom':
+                add_custom(m)
+            elif variant == 'cover':
+                add_cover(m, cover)
+            elif variant == 'multi':
+                add_multi(m)
+            m.save()
+            paths.append(template)
+            for i in xrange(1, count):
+                path = os.path.join(subdir, '{}_{}.{}'.format(name, i, ext))
+                shutil.copy(template, path)
+                paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a benchmark corpus')
+    parser.add_argument('output')
+    parser.add_argument('--count', type=int, default=10,
+                        help='copies of each seed and variant')
+    parser.add_argument('--cover-size', type=int, default=2 * 1024 * 1024,
+                        help='size of the cover in bytes')
+    args = parser.parse_args(argv)
+    paths = generate(args.output, args.count, args.cover_size)
+    print '{} files written to {}'.format(len(paths), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,202 @@
+import hashlib
+import importlib
+import json
+import mmap
+import os
+import threading
+from collections import namedtuple
+
 from .exceptions import (MutagenWrapperError, UnsupportedFormatError,
                          ReservedTagNameError)
-from .formats.id3 import ID3Format, ID3TagsWrapper
-from .formats.mp4 import MP4Format, MP4TagsWrapper
-from .formats.vorbis import VorbisFormat
+from .formats import read_id3_header
+from .memfile import MemoryFile
+from .pictures import Picture, PictureRef
+from .stats import enable_stats, measure, reset_stats, slow_files, stats
 from .version import __version__
 
 
 _formats = []
 _extensions = {}
+_load_lock = threading.Lock()
+
+
+class SaveResult(namedtuple('SaveResult', ['written', 'in_place'])):
+    """The outcome of :meth:`MediaFile.save`. *in_place* is *True* if
+    the tags were written without moving the audio data, i.e. without
+    rewriting the whole file. A result is true only if the file was written.
+    """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return self.written
+
+
+class LazyFormat(object):
+    """A format registered by the import path of its class, in the form of
+    ``'module:ClassName'``. The module is imported when the format is first
+    used.
+    """
+
+    def __init__(self, path, name, extensions):
+        self.path = path
+        self.name = name
+        self.extensions = tuple(extensions)
+
+    def load(self):
+        module, attr = self.path.split(':')
+        return getattr(importlib.import_module(module), attr)
 
 
 def supported_formats():
     """Returns a list of supported formats. The list contains tuples,
     each representing a metadata format name followed by file extensions.
     """
-    return [(f.name, tuple(f.raw_classes)) for f in _formats]
+    return [(f.name, _get_extensions(f)) for f in _formats]
 
 
-def register_format(format):
+def register_format(format, name=None, extensions=None):
+    """Registers a :class:`~mutagenwrapper.bases.Format` subclass. *format*
+    may also be the import path of the class, e.g.
+    ``'mypackage.formats:APEFormat'``, in which case *name* and
+    *extensions* must be given and the class is imported on first use.
+    """
+    if isinstance(format, basestring):
+        format = LazyFormat(format, name, extensions)
     _formats.append(format)
-    for ext in format.raw_classes:
+    for ext in _get_extensions(format):
         _extensions[ext] = format
 
 
+def get_format(extension):
+    """Returns the format class registered for *extension*, importing it if
+    necessary.
+    """
+    format = _extensions[extension]
+    if isinstance(format, LazyFormat):
+        with _load_lock:
+            # Another thread may have loaded it while this one waited
+            format = _extensions[extension]
+            if isinstance(format, LazyFormat):
+                lazy = format
+                format = lazy.load()
+                _formats[_formats.index(lazy)] = format
+                for ext in lazy.extensions:
+                    _extensions[ext] = format
+    return format
+
+
+def _get_extensions(format):
+    if isinstance(format, LazyFormat):
+        return format.extensions
+    return tuple(format.raw_classes)
+
+
+def detect_format(path):
+    """Returns the file extension under which the format of the file is
+    registered, or *None* if the format is not supported. The format is
+    detected from the first few bytes of the file, falling back to
+    the extension of *path* if the contents are not recognized.
+    """
+    with open(path, 'rb') as f:
+        return _detect(f, path)
+
+
+def _detect(fileobj, name):
+    # Detects the format of the file opened as *fileobj*, falling back to
+    # the extension of *name*, which may be None
+    extension = name.rsplit('.', 1)[-1].lower() if name else None
+    headers = []
+    header = fileobj.read(64)
+    if header.startswith('ID3') and len(header) >= 10:
+        # Look past the ID3v2 tag, which may precede any format
+        fileobj.seek(0)
+        major, flags, size = read_id3_header(fileobj)
+        fileobj.seek(10 + size + (10 if flags & 0x10 else 0))
+        headers.append(fileobj.read(64))
+    headers.append(header)
+    # Try the format for the extension first, so that the other formats
+    # need not be imported when the extension is right
+    preferred = get_format(extension) if extension in _extensions else None
+    for header in headers:
+        detected = _probe(header, [preferred] if preferred else [])
+        if detected is None:
+            detected = _probe(header, [get_format(_get_extensions(f)[0])
+                                       for f in list(_formats)])
+        if detected is not None:
+            break
+    else:
+        return extension if extension in _extensions else None
+    raw_classes = get_format(detected).raw_classes
+    if raw_classes.get(extension) is raw_classes[detected]:
+        # Prefer the more specific extension, e.g. m4b over m4a
+        return extension
+    return detected
+
+
+def _probe(header, formats):
+    for format in formats:
+        extension = format.probe(header)
+        if extension is not None:
+            return extension
+    return None
+
+
+def find_pictures(path):
+    """Returns a list of :class:`PictureRef` for the pictures embedded in
+    the file. The tags are not loaded, and the image data is read only when
+    requested from the references.
+    """
+    extension = detect_format(path)
+    if extension is None:
+        raise UnsupportedFormatError
+    return get_format(extension).find_pictures(path, extension)
+
+
+def digest(path):
+    """Returns a SHA-1 hex digest of the parts of the file that hold the
+    tags, without loading the tags or reading the audio. It changes
+    whenever the tags are written, regardless of the modification time.
+    """
+    with open(path, 'rb') as f:
+        extension = _detect(f, path)
+        if extension is None:
+            raise UnsupportedFormatError
+        f.seek(0)
+        h = hashlib.sha1()
+        for offset, size in get_format(extension).tag_regions(f, extension):
+            h.update('{}:{}:'.format(offset, size))
+            f.seek(offset)
+            while size > 0:
+                chunk = f.read(min(size, MemoryFile.chunk_size))
+                if not chunk:
+                    break
+                h.update(chunk)
+                size -= len(chunk)
+        return h.hexdigest()
+
+
+def _canonical(value):
+    # Returns a form of a tag value that can be serialized as JSON
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    elif isinstance(value, Picture):
+        # The digest is computed once however many files use the picture
+        return 'picture:' + value.digest()
+    elif isinstance(value, str):
+        # Byte strings such as image data may not be text
+        return 'data:' + hashlib.sha1(value).hexdigest()
+    return value
+
+
 def enable_case_insensitive(enable):
     """Enable or disable the feature that lowercases names for custom tags
     in ID3 and MP4 formats. This setting takes effect for newly created
     `MediaFile` instances. Existing `MediaFile` instances become unstable
-    and should not be used once this setting is changed.
+    and should not be used once this setting is changed. To change it for
+    some files only, pass *case_insensitive* to `MediaFile` instead.
     """
+    from .formats.id3 import ID3TagsWrapper
+    from .formats.mp4 import MP4TagsWrapper
     ID3TagsWrapper.case_insensitive = enable
     MP4TagsWrapper.case_insensitive = enable
 
@@ -39,34 +207,177 @@ class MediaFile(object):
     Custom tag names are prefixed by `custom_prefix`, which is three
     underscores "___" by default.
 
+    The format is detected from the contents of the file, so files with
+    wrong or missing extensions are also supported.
+
+    If *tags_only* is *True*, only the tags are loaded and the audio stream
+    is not analyzed, so ``raw.info`` is not available. Tags can still be read
+    and written as usual.
+
+    If *fields* is given, only those tags are decoded and the others are
+    skipped while parsing where possible. Other tags may read as missing,
+    so the file cannot be saved.
+
+    *case_insensitive* and *custom_prefix* override the process-wide
+    defaults for this file only, so files with different settings can be
+    used at the same time, e.g. from different threads. Custom tag names
+    in Vorbis comments are always case-insensitive.
+
+    If *format* is given, it is the extension of the format of the file,
+    e.g. ``'mp3'``, and the format is not detected.
+
+    To read files that are not on disk, see :meth:`from_fileobj` and
+    :meth:`from_buffer`.
+
     .. attribute:: raw
 
        The underlying mutagen object
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, tags_only=False, fields=None,
+                 case_insensitive=None, custom_prefix=None, format=None):
         super(MediaFile, self).__setattr__('path', path)
-        super(MediaFile, self).__setattr__('extension', path.rsplit('.', 1)[-1])
+        extension = format.lower() if format else detect_format(path)
+        super(MediaFile, self).__setattr__('extension', extension)
+        super(MediaFile, self).__setattr__('source', None)
+        super(MediaFile, self).__setattr__('tags_only', tags_only)
+        super(MediaFile, self).__setattr__('fields', fields)
+        super(MediaFile, self).__setattr__('options', {
+            'case_insensitive': case_insensitive,
+            'custom_prefix': custom_prefix,
+        })
         self._init()
 
-    def _init(self):
+    @classmethod
+    def from_fileobj(cls, fileobj, format=None, **options):
+        """Opens the file object *fileobj*. If it is a regular file, it is
+        opened through its descriptor and saving writes to it. Otherwise
+        its contents are copied to memory, and the saved file can be taken
+        with :meth:`getvalue` or :meth:`getbuffer`. *options* are passed to
+        :class:`MediaFile`.
+        """
+        return cls._open_memory_file(MemoryFile.from_fileobj(fileobj),
+                                     format, options)
+
+    @classmethod
+    def from_buffer(cls, data, format=None, **options):
+        """Opens the file whose contents are *data*, which may be a str,
+        bytearray, memoryview or mmap. The contents are copied to memory,
+        and the saved file can be taken with :meth:`getvalue` or
+        :meth:`getbuffer`. *options* are passed to :class:`MediaFile`.
+        """
+        return cls._open_memory_file(MemoryFile.from_buffer(data),
+                                     format, options)
+
+    @classmethod
+    def from_source(cls, source, format=None, block_size=4096, **options):
+        """Reads the tags of a file from a
+        :class:`~mutagenwrapper.ranges.ByteSource`, fetching only the parts
+        of the file that hold them in blocks of *block_size* bytes. The file
+        is opened with ``tags_only=True`` and cannot be saved.
+        """
+        return open_source(source, format, block_size, **options)
+
+    @classmethod
+    def _open_memory_file(cls, source, format, options):
+        try:
+            media = cls(source.path, format=format, **options)
+        except:
+            source.close()
+            raise
+        super(MediaFile, media).__setattr__('source', source)
+        return media
+
+    def getvalue(self):
+        """Returns the contents of the file as a str."""
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def getbuffer(self):
+        """Returns a read-only buffer of the contents of the file that is
+        mapped into memory, instead of being read.
+        """
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return buffer('')
+            return buffer(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+
+    def close(self):
+        """Releases the memory of a file opened by :meth:`from_fileobj` or
+        :meth:`from_buffer`. The file cannot be used afterwards.
+        """
+        if self.source is not None:
+            self.source.close()
+
+    def _init(self, op='open'):
         if self.extension in _extensions:
-            format = _extensions[self.extension]
-            wrapper = format.get_wrapper(self.path, self.extension)
+            format = get_format(self.extension)
+            super(MediaFile, self).__setattr__('format', format)
+            with measure(op, format, self.extension, self.path):
+                wrapper = format.get_wrapper(self.path, self.extension,
+                                             self.tags_only, self.fields,
+                                             **self.options)
             super(MediaFile, self).__setattr__('wrapper', wrapper)
         else:
             raise UnsupportedFormatError
 
-    def save(self, reload=False):
-        """Save changes to the file."""
-        self.wrapper.raw.save()
+    def update(self, mapping):
+        """Set the tags in *mapping*, which is a dict or an iterable of
+        (name, value) pairs.
+        """
+        if hasattr(mapping, 'iteritems'):
+            mapping = mapping.iteritems()
+        for key, value in mapping:
+            self.wrapper[key] = value
+
+    def save(self, reload=False, padding=None, only_modified=False):
+        """Save changes to the file. If *only_modified* is *True*, nothing is
+        written unless a tag has been given a different value since the file
+        was loaded, so changes made to the raw mutagen object directly are
+        not saved.
+
+        Tags are written in place if they fit in the space reserved for them.
+        Otherwise the file is rewritten, reserving at least *padding* bytes,
+        or the format's default ``padding``, for later changes.
+        Returns a :class:`SaveResult`.
+        """
+        if self.fields is not None:
+            raise MutagenWrapperError('cannot save a file opened with fields')
+        if self.source is not None and self.source.partial:
+            raise MutagenWrapperError('cannot save a partially fetched file')
+        if only_modified and not self.wrapper.modified:
+            return SaveResult(False, True)
+        size = os.path.getsize(self.path)
+        with measure('save', self.format, self.extension, self.path):
+            self.format.save(self.wrapper.raw, padding)
+        in_place = os.path.getsize(self.path) == size
+        self.wrapper.clear_modified()
         if reload:
             self.reload()
+        return SaveResult(True, in_place)
+
+    def get_pictures(self):
+        """Returns a list of :class:`PictureRef` for the pictures embedded in
+        the file. Unlike the ``picture`` tag, the image data is not read
+        until requested.
+        """
+        return find_pictures(self.path)
+
+    def tag_digest(self):
+        """Returns a SHA-1 hex digest of the tags and their values. Unlike
+        :func:`digest`, it depends only on the values, not on how they are
+        stored in the file, so it does not change when the same tags are
+        written again.
+        """
+        items = sorted((key, _canonical(value))
+                       for key, value in self.wrapper.iteritems())
+        return hashlib.sha1(json.dumps(items)).hexdigest()
 
     def reload(self):
         """Reload the file."""
-        self._init()
+        self._init('reload')
 
     def pprint(self, raw=False):
         """Print the metadata in a human-friendly form.
@@ -87,7 +398,7 @@ class MediaFile(object):
             print fmt.format(k, cutoff(v, 100))
 
     def __getattr__(self, key):
-        return getattr(self.wrapper, key)
+        return self.wrapper._decode(key)
 
     def __setattr__(self, key, value):
         setattr(self.wrapper, key, value)
@@ -126,6 +437,18 @@ def cutoff(s, length=120):
         return s[:i] + '...' + s[-j:]
 
 
-register_format(ID3Format)
-register_format(MP4Format)
-register_format(VorbisFormat)
+register_format('mutagenwrapper.formats.id3:ID3Format', 'ID3',
+                ['mp3', 'mp2', 'tta'])
+register_format('mutagenwrapper.formats.mp4:MP4Format', 'MP4',
+                ['m4a', 'm4b', 'm4p', 'm4v', 'mp4'])
+register_format('mutagenwrapper.formats.vorbis:VorbisFormat', 'Vorbis',
+                ['flac', 'ogg', 'oggflac', 'oggspeex', 'oggtheora'])
+
+# Imported last, as these modules depend on the names defined above.
+from .scanner import ScanResult, scan
+from .index import LibraryIndex
+from .columns import extract_columns
+from .ranges import ByteSource, FileSource, open_source
+from .bulk import ApplyResult, apply_changes
+from .library import Library, Page
+from .watch import WatchEvent, Watcher
@@ -0,0 +1,293 @@
+import os
+import weakref
+from collections import OrderedDict, deque
+from functools import partial
+
+try:
+    import asyncio
+except ImportError:
+    # asyncio is available as trollius in Python 2
+    import trollius as asyncio
+
+from . import MediaFile
+from .scanner import iter_paths, _scan_one
+
+try:
+    _StopAsyncIteration = StopAsyncIteration
+except NameError:
+    _StopAsyncIteration = StopIteration
+
+
+class Runner(object):
+    """Runs blocking calls in *executor*, or in the default executor of
+    the event loop if *None*. At most *limit* calls run at the same time
+    for files on the same storage device, so that a slow disk does not
+    hold up the others.
+    """
+
+    #: The number of directories whose devices are remembered.
+    cache_size = 1024
+
+    def __init__(self, executor=None, limit=4, loop=None):
+        self.executor = executor
+        self.limit = limit
+        self.loop = loop
+        self._devices = OrderedDict()
+        # Semaphores belong to the loop they were created for
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def get_loop(self):
+        return self.loop or asyncio.get_event_loop()
+
+    def run(self, path, func, *args, **kwargs):
+        """Returns a future of ``func(*args, **kwargs)``, which is called
+        in the executor once a slot for the device of *path* is free.
+        """
+        loop = self.get_loop()
+        result = asyncio.Future(loop=loop)
+        call = partial(func, *args, **kwargs)
+        dirname = os.path.dirname(path)
+
+        def acquire(device):
+            semaphore = self._get_semaphore(loop, device)
+
+            def start(acquired):
+                if result.cancelled():
+                    semaphore.release()
+                    return
+                job = loop.run_in_executor(self.executor, call)
+                job.add_done_callback(partial(finish, semaphore))
+
+            future = asyncio.ensure_future(semaphore.acquire(), loop=loop)
+            future.add_done_callback(start)
+
+        def finish(semaphore, job):
+            semaphore.release()
+            if result.cancelled():
+                return
+            if job.cancelled():
+                result.cancel()
+            elif job.exception() is not None:
+                result.set_exception(job.exception())
+            else:
+                result.set_result(job.result())
+
+        def found(job):
+            device = None
+            if not job.cancelled() and job.exception() is None:
+                device = job.result()
+            if device is not None:
+                if len(self._devices) >= self.cache_size:
+                    self._devices.popitem(last=False)
+                self._devices[dirname] = device
+            acquire(device)
+
+        device = self._devices.get(dirname)
+        if device is None:
+            # os.stat() may block, so it runs in the executor too
+            job = loop.run_in_executor(self.executor, _get_device, dirname)
+            job.add_done_callback(found)
+        else:
+            acquire(device)
+        return result
+
+    def _get_semaphore(self, loop, device):
+        semaphores = self._semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(device)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit, loop=loop)
+            semaphores[device] = semaphore
+        return semaphore
+
+
+def _get_device(dirname):
+    # Returns None if the directory cannot be read, in which case the call
+    # itself reports the error
+    try:
+        return os.stat(dirname or '.').st_dev
+    except OSError:
+        return None
+
+
+_default_runner = Runner()
+
+
+class AsyncMediaFile(object):
+    """A :class:`~mutagenwrapper.MediaFile` whose methods that access
+    the file return futures instead of blocking. Tags are read and set
+    in memory as usual.
+
+    .. attribute:: media
+
+       The underlying :class:`~mutagenwrapper.MediaFile`
+
+    """
+
+    def __init__(self, media, runner=None):
+        super(AsyncMediaFile, self).__setattr__('media', media)
+        super(AsyncMediaFile, self).__setattr__('runner',
+                                                runner or _default_runner)
+
+    def save(self, **kwargs):
+        """Returns a future of :meth:`MediaFile.save`."""
+        return self.runner.run(self.media.path, self.media.save, **kwargs)
+
+    def reload(self):
+        """Returns a future of :meth:`MediaFile.reload`."""
+        return self.runner.run(self.media.path, self.media.reload)
+
+    def __getattr__(self, key):
+        return getattr(self.media, key)
+
+    def __setattr__(self, key, value):
+        setattr(self.media, key, value)
+
+    def __delattr__(self, key):
+        delattr(self.media, key)
+
+    def __getitem__(self, key):
+        return self.media[key]
+
+    def __setitem__(self, key, value):
+        self.media[key] = value
+
+    def __delitem__(self, key):
+        del self.media[key]
+
+    def __iter__(self):
+        return iter(self.media)
+
+    def __len__(self):
+        return len(self.media)
+
+    def __contains__(self, key):
+        return key in self.media
+
+
+def open_media(path, runner=None, **options):
+    """Returns a future of an :class:`AsyncMediaFile` for the file at *path*.
+    *options* are passed to :class:`~mutagenwrapper.MediaFile`. The file is
+    loaded by *runner*, which must use threads rather than processes.
+    """
+    runner = runner or _default_runner
+    result = asyncio.Future(loop=runner.get_loop())
+
+    def done(job):
+        if result.cancelled():
+            return
+        if job.cancelled():
+            result.cancel()
+        elif job.exception() is not None:
+            result.set_exception(job.exception())
+        else:
+            result.set_result(AsyncMediaFile(job.result(), runner))
+
+    runner.run(path, MediaFile, path, **options).add_done_callback(done)
+    return result
+
+
+def scan(roots, limit=16, runner=None, **options):
+    """Returns an asynchronous iterator of
+    :class:`~mutagenwrapper.ScanResult` for the files under *roots*,
+    in the order they are read. At most *limit* files are read or
+    buffered at a time. Directories are walked in the default executor
+    of the event loop.
+    """
+    return AsyncScan(roots, limit, runner or _default_runner, options)
+
+
+class AsyncScan(object):
+    """An asynchronous iterator returned by :func:`scan`. With Python 2,
+    call :meth:`next` to get a future of the next result, which raises
+    :exc:`StopIteration` when the scan is over.
+    """
+
+    def __init__(self, roots, limit, runner, options):
+        self.limit = limit
+        self.runner = runner
+        self.options = options
+        self._paths = iter_paths(roots)
+        self._queue = deque()
+        self._results = deque()
+        self._waiters = deque()
+        self._running = 0
+        self._walking = False
+        self._exhausted = False
+        self._error = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next()
+
+    def next(self):
+        future = asyncio.Future(loop=self.runner.get_loop())
+        self._waiters.append(future)
+        self._fill()
+        self._deliver()
+        return future
+
+    def _fill(self):
+        pending = self._running + len(self._queue) + len(self._results)
+        if self._walking or self._exhausted or pending >= self.limit:
+            return
+        self._walking = True
+        job = self.runner.get_loop().run_in_executor(
+            None, _take, self._paths, self.limit)
+        job.add_done_callback(self._walked)
+
+    def _walked(self, job):
+        self._walking = False
+        if job.cancelled() or job.exception() is not None:
+            self._exhausted = True
+            self._error = None if job.cancelled() else job.exception()
+            paths = []
+        else:
+            paths = job.result()
+            if len(paths) < self.limit:
+                self._exhausted = True
+        self._queue.extend(paths)
+        self._start()
+        self._deliver()
+
+    def _start(self):
+        while self._queue and self._running < self.limit:
+            path = self._queue.popleft()
+            self._running += 1
+            future = self.runner.run(path, _scan_one, path, **self.options)
+            future.add_done_callback(self._read)
+        self._fill()
+
+    def _read(self, future):
+        self._running -= 1
+        if not future.cancelled():
+            self._results.append(future.result())
+        self._start()
+        self._deliver()
+
+    def _deliver(self):
+        while self._waiters and self._results:
+            waiter = self._waiters.popleft()
+            if not waiter.cancelled():
+                waiter.set_result(self._results.popleft())
+        if (self._exhausted and not self._walking and not self._queue and
+                not self._running and not self._results):
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.cancelled():
+                    continue
+                if self._error is not None:
+                    waiter.set_exception(self._error)
+                    self._error = None
+                else:
+                    waiter.set_exception(_StopAsyncIteration())
+
+
+def _take(iterator, n):
+    ret = []
+    for item in iterator:
+        ret.append(item)
+        if len(ret) == n:
+            break
+    return ret
@@ -1,4 +1,7 @@
+import threading
+
 from .exceptions import ReservedTagNameError
+from .stats import measure, stats_enabled
 
 
 class TagHandler(object):
@@ -12,6 +15,10 @@ class TagHandler(object):
     def __delete__(self, obj):
         raise NotImplementedError(self._niemsg('delete'))
 
+    def is_present(self, obj):
+        """Returns whether the tag is stored in *obj*."""
+        return bool(obj.raw.get(self.name))
+
     def _niemsg(self, meth):
         cls_name = self.__class__.__name__
         return "{} doesn't implement __{}__()".format(cls_name, meth)
@@ -108,68 +115,247 @@ class PairTagHandler(TagHandler):
 class TagsWrapperMeta(type):
 
     def __new__(cls, name, bases, attrs):
+        # Inherited handlers are included, so that looking one up takes
+        # a single dict lookup
         handlers = {}
+        for base in reversed(bases):
+            handlers.update(getattr(base, '__handlers__', {}))
         lut = {}
         for attrname, attr in attrs.iteritems():
             if isinstance(attr, TagHandler):
                 handlers[attrname] = attr
                 if hasattr(attr, 'name'):
                     lut.setdefault(attr.name, []).append(attrname)
+            else:
+                handlers.pop(attrname, None)
         attrs['__handlers__'] = handlers
-        attrs['__custom_handlers__'] = {}
+        attrs['__custom_handlers__'] = HandlerCache()
         attrs['__lut__'] = lut
         return super(TagsWrapperMeta, cls).__new__(cls, name, bases, attrs)
 
 
+class HandlerCache(object):
+    """A thread-safe cache of at most *maxsize* custom tag handlers, keyed
+    by tag name. It is emptied when it is full and another handler is
+    added, so that looking up a cached handler takes no lock.
+    """
+
+    maxsize = 1024
+
+    def __init__(self, maxsize=None):
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.handlers = {}
+
+    def get(self, name, factory):
+        """Returns the handler for *name*, creating it with
+        *factory(name)* if it is not in the cache.
+        """
+        handler = self.handlers.get(name)
+        if handler is None:
+            handler = factory(name)
+            with self.lock:
+                if len(self.handlers) >= self.maxsize:
+                    self.handlers.clear()
+                self.handlers[name] = handler
+        return handler
+
+    def __len__(self):
+        return len(self.handlers)
+
+
 class TagsWrapper(object):
     __metaclass__ = TagsWrapperMeta
 
     # Class variables set by metaclass
     __handlers__ = {}
-    __custom_handlers__ = {}
+    __custom_handlers__ = HandlerCache()
     __lut__ = {}
 
+    # Defaults for the options of the same names
     case_insensitive = False
     custom_prefix = '___'
 
-    def __init__(self, raw):
+    # The (format, extension, path) of the file, for stats
+    origin = (None, None, None)
+
+    def __init__(self, raw, fields=None, case_insensitive=None,
+                 custom_prefix=None):
         super(TagsWrapper, self).__setattr__('raw', raw)
-        cls = self.__class__
-        custom_handlers = cls.__custom_handlers__
-        prefix = cls.custom_prefix
-        for name in self.get_tags():
-            if name.startswith(prefix) and name not in custom_handlers:
-                custom_handlers[name] = self.get_custom_tag_handler(name)
-                setattr(cls, name, custom_handlers[name])
+        if case_insensitive is not None:
+            super(TagsWrapper, self).__setattr__('case_insensitive',
+                                                 case_insensitive)
+        if custom_prefix is not None:
+            super(TagsWrapper, self).__setattr__('custom_prefix',
+                                                 custom_prefix)
+        if fields is not None:
+            fields = frozenset(fields)
+        super(TagsWrapper, self).__setattr__('fields', fields)
+        # The names of tags in the file, updated as tags are set or deleted
+        super(TagsWrapper, self).__setattr__('_keys', None)
+        # The names of tags whose values have been changed
+        super(TagsWrapper, self).__setattr__('modified', set())
+        # The values that changed tags had when they were loaded or saved
+        super(TagsWrapper, self).__setattr__('_saved_values', {})
 
     def get_tags(self):
         """Iterates the names of tags in the file."""
         raise NotImplementedError
 
-    def get_custom_tag_handler(self, name):
-        """Returns a descriptor that handles the custom tag."""
+    @classmethod
+    def get_custom_tag_handler(cls, name):
+        """Returns a descriptor that handles the custom tag *name*, given
+        without the prefix.
+        """
         raise NotImplementedError
 
-    def __setattr__(self, key, value):
+    @classmethod
+    def get_raw_names(cls, fields, custom_prefix=None):
+        """Returns the set of the raw tag names in which *fields* are stored.
+        Fields that are not stored under a single name, such as pictures
+        in FLAC files, are left out.
+        """
+        prefix = custom_prefix or cls.custom_prefix
+        names = set()
+        for field in fields:
+            if field in cls.__handlers__:
+                handler = cls.__handlers__[field]
+            elif field.startswith(prefix):
+                handler = cls.get_custom_tag_handler(field[len(prefix):])
+            else:
+                continue
+            if hasattr(handler, 'name'):
+                names.add(handler.name)
+        return names
+
+    def _iter_tags(self):
+        if self.fields is None:
+            return iter(self.get_tags())
+        return (k for k in self.get_tags() if k in self.fields)
+
+    def _get_keys(self):
+        if self._keys is None:
+            super(TagsWrapper, self).__setattr__('_keys',
+                                                 set(self._iter_tags()))
+        return self._keys
+
+    def _get_handler(self, key):
+        """Returns the descriptor that handles the tag *key*, or *None* if
+        *key* is not a tag. Handlers for custom tags are not set on the
+        class, but kept in a bounded cache shared by its instances.
+        """
         cls = self.__class__
-        if cls.case_insensitive:
+        handler = cls.__handlers__.get(key)
+        prefix = self.custom_prefix
+        if handler is None and key.startswith(prefix):
+            handler = cls.__custom_handlers__.get(key[len(prefix):],
+                                                  cls.get_custom_tag_handler)
+        return handler
+
+    def set_origin(self, format, extension, path):
+        super(TagsWrapper, self).__setattr__('origin',
+                                             (format, extension, path))
+
+    def _decode(self, key):
+        """Returns the value of the tag *key*, which is measured as
+        a decode if stats are enabled. Other attributes are returned as is.
+        """
+        if not stats_enabled():
+            return getattr(self, key)
+        name = key.lower() if self.case_insensitive else key
+        handler = self._get_handler(name)
+        if handler is None:
+            return getattr(self, key)
+        with measure('decode', *self.origin, io=False):
+            return handler.__get__(self, self.__class__)
+
+    def _update_keys(self, key, handler):
+        """Updates the cached names after the tag *key* has been changed."""
+        if self._keys is None:
+            return
+        name = getattr(handler, 'name', None)
+        if name is None:
+            # Can't tell which names are affected
+            super(TagsWrapper, self).__setattr__('_keys', None)
+            return
+        present = handler.is_present(self)
+        for k in self.__class__.__lut__.get(name, [key]):
+            if self.fields is not None and k not in self.fields:
+                continue
+            if present:
+                self._keys.add(k)
+            else:
+                self._keys.discard(k)
+
+    def _linked_keys(self, key, handler):
+        """Returns the tags stored in the same raw tag as *key*, such as
+        tracknumber and tracktotal, including *key*.
+        """
+        keys = self.__class__.__lut__.get(getattr(handler, 'name', None))
+        if not keys or key not in keys:
+            return [key]
+        return keys
+
+    def _get_values(self, keys):
+        cls = self.__class__
+        return [self._get_handler(k).__get__(self, cls) for k in keys]
+
+    def _update_modified(self, keys, old_values):
+        # A tag set back to the value it was loaded with is not modified
+        for k, old_value, new_value in zip(keys, old_values,
+                                           self._get_values(keys)):
+            saved = self._saved_values.setdefault(k, old_value)
+            if new_value != saved:
+                self.modified.add(k)
+            else:
+                self.modified.discard(k)
+
+    def clear_modified(self):
+        """Marks all tags as unmodified, e.g. after they have been saved."""
+        self.modified.clear()
+        self._saved_values.clear()
+
+    def __getattr__(self, key):
+        # Only called for names that are not class attributes,
+        # which include custom tags
+        if self.case_insensitive:
             key = key.lower()
-        try:
-            getattr(self, key)
+        if not key.startswith(self.custom_prefix):
+            raise AttributeError(key)
+        return self._get_handler(key).__get__(self, self.__class__)
+
+    def __setattr__(self, key, value):
+        if self.case_insensitive:
+            key = key.lower()
+        handler = self._get_handler(key)
+        if handler is None:
+            getattr(self, key)  # Raises AttributeError for unknown names
             super(TagsWrapper, self).__setattr__(key, value)
-        except AttributeError:
-            custom_handlers = cls.__custom_handlers__
-            if key.startswith(cls.custom_prefix) and key not in custom_handlers:
-                custom_handlers[key] = self.get_custom_tag_handler(key)
-                setattr(cls, key, custom_handlers[key])
-                setattr(self, key, value)
-            else:
-                raise
+            return
+        keys = self._linked_keys(key, handler)
+        old_values = self._get_values(keys)
+        handler.__set__(self, value)
+        self._update_keys(key, handler)
+        self._update_modified(keys, old_values)
+
+    def __delattr__(self, key):
+        if self.case_insensitive:
+            key = key.lower()
+        handler = self._get_handler(key)
+        if handler is None:
+            super(TagsWrapper, self).__delattr__(key)
+            return
+        keys = self._linked_keys(key, handler)
+        old_values = self._get_values(keys)
+        handler.__delete__(self)
+        self._update_keys(key, handler)
+        self._update_modified(keys, old_values)
 
     # Dictionary-compatible methods
     #
     def __getitem__(self, key):
-        return getattr(self, key)
+        return self._decode(key)
 
     def __setitem__(self, key, value):
         return setattr(self, key, value)
@@ -178,42 +364,48 @@ class TagsWrapper(object):
         return delattr(self, key)
 
     def __iter__(self):
-        return iter(self.get_tags())
+        return iter(list(self._get_keys()))
 
     def __len__(self):
-        return len(list(self.get_tags()))
+        return len(self._get_keys())
 
     def __contains__(self, key):
-        for k in self.get_tags():
-            if k == key:
-                return True
-        return False
+        return key in self._get_keys()
 
     def get(self, key, default=None):
         try:
-            return getattr(self, key)
+            return self._decode(key)
         except KeyError:
             return default
 
     def keys(self):
-        return list(self.get_tags())
+        return list(self._get_keys())
 
     def iterkeys(self):
-        return iter(self.get_tags())
+        return iter(self.keys())
 
     def values(self):
         return list(self.itervalues())
 
     def itervalues(self):
-        for key in self.get_tags():
-            yield getattr(self, key)
+        for key in self.keys():
+            yield self._decode(key)
 
     def items(self):
         return list(self.iteritems())
 
     def iteritems(self):
-        for key in self.get_tags():
-            yield (key, getattr(self, key))
+        for key in self.keys():
+            yield (key, self._decode(key))
+
+
+def _find_handler(cls, key):
+    # Looks up the class dicts directly, as getattr() would call __get__()
+    for klass in cls.__mro__:
+        attr = klass.__dict__.get(key)
+        if attr is not None:
+            return attr if isinstance(attr, TagHandler) else None
+    return None
 
 
 class FreeformTagsWrapper(TagsWrapper):
@@ -227,21 +419,28 @@ class FreeformTagsWrapper(TagsWrapper):
         for name, value in self.raw.iteritems():
             if not value:
                 continue
+            name = cls.get_handler_name(name)
             if name in cls.__lut__:
                 ret.update(cls.__lut__[name])
             elif h.is_encoded_custom_name(name):
                 name = h.decode_custom_name(name)
-                if cls.case_insensitive:
+                if self.case_insensitive:
                     name = name.lower()
-                ret.add(cls.custom_prefix + name)
+                ret.add(self.custom_prefix + name)
             else:
                 # XXX not-yet-mapped non-freeform tags are ignored here
                 pass
         return ret
 
-    def get_custom_tag_handler(self, name):
-        cls = self.__class__
-        name = name[len(cls.custom_prefix):]
+    @classmethod
+    def get_handler_name(cls, name):
+        """Returns the name of the handler of the raw tag *name*, for tags
+        that a handler stores under several names.
+        """
+        return name
+
+    @classmethod
+    def get_custom_tag_handler(cls, name):
         if cls.freeform_tag_handler.encode_custom_name(name) in cls.__lut__:
             raise ReservedTagNameError
         return cls.freeform_tag_handler(name)
@@ -267,5 +466,80 @@ class PrefixFreeformTagMixin(object):
 class Format(object):
 
     @classmethod
-    def get_wrapper(cls, path, extension):
-        return cls.wrapper_class(cls.raw_classes[extension](path))
+    def get_wrapper(cls, path, extension, tags_only=False, fields=None,
+                    case_insensitive=None, custom_prefix=None):
+        if fields is not None:
+            raw = cls.load_fields(path, extension, fields, custom_prefix)
+        elif tags_only:
+            raw = cls.tags_classes[extension](path)
+        else:
+            raw = cls.raw_classes[extension](path)
+        wrapper = cls.wrapper_class(raw, fields, case_insensitive,
+                                    custom_prefix)
+        wrapper.set_origin(cls, extension, path)
+        return wrapper
+
+    #: A list of (offset, bytes, extension) tuples. A file whose contents
+    #: match the bytes at the offset is detected as the extension.
+    magic = []
+
+    @classmethod
+    def probe(cls, header):
+        """Returns the extension of the format of a file that starts with
+        *header*, or *None* if the file is not in this format.
+        """
+        for offset, magic, extension in cls.magic:
+            if header[offset:offset + len(magic)] == magic:
+                return extension
+        return None
+
+    #: The minimum number of bytes of padding to reserve when the tags no
+    #: longer fit in the space they take up and the file has to be rewritten.
+    #: Formats without padding ignore this.
+    padding = 0
+
+    @classmethod
+    def save(cls, raw, padding=None):
+        """Saves *raw*, reserving *padding* bytes, or :attr:`padding` bytes
+        if *None*, if the tags have to grow.
+        """
+        raw.save()
+
+    @classmethod
+    def saves_in_place(cls, extension):
+        """Returns whether tags that fit in the space reserved for them are
+        saved without moving the rest of the file.
+        """
+        return True
+
+    @classmethod
+    def load_fields(cls, path, extension, fields, custom_prefix=None):
+        """Loads the tags that are needed to read *fields*, in which custom
+        tags are prefixed by *custom_prefix*, skipping the others where
+        the format allows it. The returned object may lack other tags,
+        so it must not be saved.
+        """
+        return cls.tags_classes[extension](path)
+
+    @classmethod
+    def find_pictures(cls, path, extension):
+        """Returns a list of :class:`~mutagenwrapper.pictures.PictureRef`
+        for the pictures embedded in the file, without reading the image data
+        where possible.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def tag_regions(cls, fileobj, extension):
+        """Returns a list of (offset, size) of the parts of *fileobj* that
+        hold the tags, reading only the headers needed to find them.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def fetch_tags(cls, fileobj, extension):
+        """Reads the parts of *fileobj* that :attr:`tags_classes` need to
+        load the tags, and as little else as possible. Used to read tags
+        from sources where every byte read is costly.
+        """
+        raise NotImplementedError
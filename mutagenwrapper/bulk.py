@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from functools import partial
+
+from . import MediaFile, _canonical
+from .memfile import MemoryFile
+from .ranges import FileSource, RangeReader
+
+
+class ApplyResult(namedtuple('ApplyResult',
+                             ['written', 'unchanged', 'skipped', 'errors'])):
+    """The result of :func:`apply_changes`. *written* is the number of files
+    written, *unchanged* the number of files whose tags already had the
+    values, and *skipped* the number of changes that the journal records as
+    done by an earlier run. *errors* maps the paths of the files that could
+    not be changed to error messages.
+    """
+    __slots__ = ()
+
+
+def apply_changes(changes, journal=None, workers=None, chunksize=16,
+                  batch_size=64, padding=None, **options):
+    """Applies *changes*, an iterable of (path, {field: value}) pairs, in
+    a pool of *workers* processes, and returns an :class:`ApplyResult`.
+    A value of *None* deletes the tag. *padding* is passed to
+    :meth:`~mutagenwrapper.MediaFile.save`, and *options* to
+    :class:`~mutagenwrapper.MediaFile`.
+
+    Tags that fit in the space reserved for them are written in place.
+    Otherwise the file is written to a temporary file in the same
+    directory, which replaces the original with :func:`os.rename`, so an
+    interrupted run leaves either the old or the new file.
+
+    Files are synced to disk in batches of *batch_size*. If *journal* is
+    a path, each batch of finished changes is then appended to it, and
+    changes recorded there are skipped, so a run that was interrupted can
+    be resumed by calling this again with the same arguments. Failed
+    changes are retried. Temporary files are recorded in the journal when
+    they are created, and those left by an interrupted run are removed.
+    Runs that share a journal must not overlap.
+
+    A file may be changed only once in a run; further changes to it are
+    not applied and are reported in *errors*.
+    """
+    if journal:
+        done, temps = _read_journal(journal)
+        log = _open_journal(journal)
+        for temp in temps:
+            _remove(temp)
+    else:
+        done, log = set(), None
+    result = ApplyResult(0, 0, 0, {})
+    counts = {'written': 0, 'unchanged': 0, 'skipped': 0}
+    seen = set()
+    duplicates = []
+
+    def pending():
+        for path, fields in changes:
+            real = os.path.realpath(path)
+            if real in seen:
+                # Two workers must not write the same file at once
+                duplicates.append(path)
+                continue
+            seen.add(real)
+            key = _change_key(path, fields)
+            if key in done:
+                counts['skipped'] += 1
+            else:
+                yield path, fields, key
+
+    func = partial(_apply_one, padding=padding, journal=journal, **options)
+    if workers == 1:
+        results = (func(item) for item in pending())
+        pool = None
+    else:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        results = pool.imap_unordered(func, pending(), chunksize)
+    batch = []
+    try:
+        for entry in results:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                full, batch = batch, []
+                _commit(full, log, counts, result.errors)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        try:
+            # Finished changes are kept even if the run is interrupted
+            _commit(batch, log, counts, result.errors)
+        finally:
+            if log is not None:
+                log.close()
+    for path in duplicates:
+        result.errors.setdefault(
+            path, u'ValueError: the file is changed more than once')
+    return result._replace(**counts)
+
+
+def _apply_one(item, padding=None, journal=None, **options):
+    path, fields, key = item
+    entry = {'path': path, 'key': key, 'written': False, 'in_place': True,
+             'temp': None}
+    try:
+        m = MediaFile(path, **options)
+        _update(m, fields)
+        if not m.wrapper.modified:
+            return entry
+        if _fits_in_place(m, fields, padding, options):
+            entry['written'], entry['in_place'] = m.save(padding=padding)
+        else:
+            entry['temp'] = _rewrite(m, fields, padding, options, journal)
+            entry['written'], entry['in_place'] = True, False
+    except Exception as e:
+        entry['error'] = u'{}: {}'.format(type(e).__name__, e)
+    return entry
+
+
+def _update(m, fields):
+    for name, value in fields.iteritems():
+        if value is None:
+            del m[name]
+        else:
+            m[name] = value
+
+
+def _fits_in_place(m, fields, padding, options):
+    """Saves the changes to an image of the tags of *m* in memory, and
+    returns whether they were written without resizing it.
+    """
+    if not m.format.saves_in_place(m.extension):
+        return False
+    reader = RangeReader(FileSource(m.path))
+    try:
+        m.format.fetch_tags(reader, m.extension)
+    except NotImplementedError:
+        return False
+    # Only the bytes up to the tags are kept, so that growing them moves
+    # little data even if they come first.
+    size = min(reader.size, (max(reader.blocks) + 1) * reader.block_size)
+    image = MemoryFile()
+    try:
+        reader.write_image(image.fd, size)
+        sim = MediaFile(image.path, format=m.extension,
+                        **dict(options, tags_only=True))
+        _update(sim, fields)
+        sim.format.save(sim.wrapper.raw, padding)
+        return os.fstat(image.fd).st_size == size
+    finally:
+        image.close()
+
+
+def _rewrite(m, fields, padding, options, journal=None):
+    """Saves the changes to a copy of the file at *m.path*, and returns the
+    path of the copy, which is recorded in *journal* first.
+    """
+    # Imported here to keep importing the package cheap
+    import tempfile
+    directory, name = os.path.split(m.path)
+    fd, temp = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp',
+                                dir=directory or '.')
+    os.close(fd)
+    try:
+        if journal:
+            # Workers append to the journal too, each line in one write
+            _append(journal, [{'temp': os.path.abspath(temp)}])
+        shutil.copyfile(m.path, temp)
+        shutil.copymode(m.path, temp)
+        copy = MediaFile(temp, format=m.extension, **options)
+        _update(copy, fields)
+        copy.save(padding=padding)
+    except:
+        os.remove(temp)
+        raise
+    return temp
+
+
+def _commit(batch, log, counts, errors):
+    """Syncs the files written in *batch*, moves the rewritten files into
+    place and records the changes in the journal *log*.
+    """
+    for entry in batch:
+        if entry['written']:
+            _fsync(entry['temp'] or entry['path'])
+    directories = set()
+    for entry in batch:
+        temp = entry.pop('temp')
+        if temp is None:
+            continue
+        try:
+            os.rename(temp, entry['path'])
+        except OSError as e:
+            os.remove(temp)
+            entry['written'] = False
+            entry['error'] = u'{}: {}'.format(type(e).__name__, e)
+        else:
+            directories.add(os.path.dirname(entry['path']) or '.')
+    for directory in directories:
+        _fsync(directory)
+    for entry in batch:
+        if 'error' in entry:
+            errors[entry['path']] = entry['error']
+        elif entry['written']:
+            counts['written'] += 1
+        else:
+            counts['unchanged'] += 1
+    if log is not None and batch:
+        _write_entries(log.fileno(), batch)
+
+
+def _append(journal, entries):
+    """Appends *entries* to the journal at the path *journal*."""
+    fd = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        _write_entries(fd, entries)
+    finally:
+        os.close(fd)
+
+
+def _write_entries(fd, entries):
+    # The lines are written with a single write() to a file opened for
+    # appending, so that those of other processes are not interleaved
+    data = ''.join(json.dumps(entry, sort_keys=True) + '\n'
+                   for entry in entries)
+    while data:
+        data = data[os.write(fd, data):]
+    os.fsync(fd)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _change_key(path, fields):
+    fields = dict((name, _canonical(value))
+                  for name, value in fields.iteritems())
+    data = json.dumps([path, fields], sort_keys=True, default=repr)
+    return hashlib.sha1(data).hexdigest()
+
+
+def _open_journal(path):
+    log = open(path, 'a+')
+    log.seek(0, 2)
+    if log.tell():
+        log.seek(-1, 2)
+        if log.read(1) != '\n':
+            # Ends the line that an interrupted run left incomplete
+            log.write('\n')
+            log.flush()
+    return log
+
+
+def _read_journal(path):
+    """Returns the keys of the changes that the journal at *path* records
+    as done, and the paths of the temporary files it records.
+    """
+    done = set()
+    temps = set()
+    if not os.path.exists(path):
+        return done, temps
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be incomplete
+                continue
+            if 'key' not in entry:
+                temps.add(entry['temp'])
+            elif 'error' not in entry:
+                done.add(entry['key'])
+    return done, temps
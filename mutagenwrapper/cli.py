@@ -0,0 +1,165 @@
+import argparse
+import json
+import sys
+from functools import partial
+
+from . import MediaFile, supported_formats
+from .columns import integer_fields
+from .index import encode_tags
+from .scanner import iter_paths, read_tags
+
+
+def main(argv=None):
+    """Runs the command line tool with *argv*, which defaults to
+    ``sys.argv[1:]``, and returns the exit status.
+    """
+    extensions = sorted(ext for name, exts in supported_formats()
+                        for ext in exts)
+    parser = argparse.ArgumentParser(
+        prog='mutagenwrapper',
+        description='Read and write tags of audio files. Results are '
+                    'written as JSON lines, one per file, as they are done.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_parser(name, help, func, parallel=False):
+        p = subparsers.add_parser(name, help=help)
+        p.set_defaults(func=func, parser=p)
+        p.add_argument('paths', nargs='+', metavar='PATH',
+                       help='files or directories')
+        p.add_argument('--ext', action='append', choices=extensions,
+                       metavar='EXT', help='only files with the extension '
+                       '(repeatable); one of ' + ', '.join(extensions))
+        if parallel:
+            p.add_argument('-j', '--jobs', type=int, default=None,
+                           help='worker processes (default: number of CPUs)')
+            p.add_argument('--chunksize', type=int, default=1,
+                           help='files sent to a worker at a time')
+        return p
+
+    p = add_parser('dump', 'print the tags of files in order', dump)
+    p.add_argument('--tags-only', action='store_true')
+    p.add_argument('--field', action='append', dest='fields',
+                   metavar='NAME', help='only the tag (repeatable)')
+    p = add_parser('scan', 'print the tags of files in parallel, in the '
+                   'order they are read', scan, parallel=True)
+    p.add_argument('--tags-only', action='store_true')
+    p.add_argument('--field', action='append', dest='fields',
+                   metavar='NAME', help='only the tag (repeatable)')
+    p = add_parser('set', 'set or delete tags of files', set_tags,
+                   parallel=True)
+    p.add_argument('-t', '--tag', action='append', default=[],
+                   metavar='NAME=VALUE', help='set the tag; repeat the name '
+                   'for multiple values')
+    p.add_argument('-d', '--delete', action='append', default=[],
+                   metavar='NAME', help='delete the tag')
+    p = add_parser('pprint', 'pretty-print the tags of files', pprint)
+    p.add_argument('--raw', action='store_true',
+                   help='print the unmodified keys and values')
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def dump(args):
+    options = _read_options(args)
+    return _write_results(_read(path, **options) for path in _paths(args))
+
+
+def scan(args):
+    func = partial(_read, **_read_options(args))
+    return _write_results(_imap(func, _paths(args), args.jobs,
+                                args.chunksize))
+
+
+def set_tags(args):
+    tags = {}
+    for tag in args.tag:
+        name, sep, value = tag.partition('=')
+        if not sep:
+            args.parser.error('invalid tag: {}'.format(tag))
+        value = value.decode(sys.getfilesystemencoding() or 'utf-8')
+        if name in integer_fields:
+            try:
+                value = int(value)
+            except ValueError:
+                args.parser.error(
+                    '{} must be an integer: {}'.format(name, tag))
+        tags.setdefault(name, []).append(value)
+    func = partial(_set, tags=tags, deletes=args.delete)
+    return _write_results(_imap(func, _paths(args), args.jobs,
+                                args.chunksize))
+
+
+def pprint(args):
+    status = 0
+    for path in _paths(args):
+        try:
+            MediaFile(path).pprint(args.raw)
+        except Exception as e:
+            sys.stderr.write('{}: {}\n'.format(path, _format_error(e)))
+            status = 1
+    return status
+
+
+def _paths(args):
+    paths = iter_paths(args.paths)
+    if args.ext:
+        extensions = set(args.ext)
+        paths = (p for p in paths
+                 if p.rsplit('.', 1)[-1].lower() in extensions)
+    return paths
+
+
+def _read_options(args):
+    return {'tags_only': args.tags_only, 'fields': args.fields}
+
+
+def _read(path, **options):
+    try:
+        tags = encode_tags(read_tags(path, **options))
+        return {'path': path, 'tags': tags}
+    except Exception as e:
+        return {'path': path, 'error': _format_error(e)}
+
+
+def _set(path, tags, deletes):
+    try:
+        m = MediaFile(path)
+        for name in deletes:
+            del m[name]
+        for name, values in tags.iteritems():
+            m[name] = values if len(values) > 1 else values[0]
+        written, in_place = m.save(only_modified=True)
+        return {'path': path, 'written': written, 'in_place': in_place}
+    except Exception as e:
+        return {'path': path, 'error': _format_error(e)}
+
+
+def _imap(func, items, jobs, chunksize):
+    if jobs == 1:
+        for item in items:
+            yield func(item)
+        return
+    from multiprocessing import Pool
+    pool = Pool(jobs)
+    try:
+        for result in pool.imap_unordered(func, items, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _write_results(results, out=None):
+    out = out or sys.stdout
+    status = 0
+    for result in results:
+        if 'error' in result:
+            status = 1
+        out.write(json.dumps(result, sort_keys=True, default=unicode) + '\n')
+        out.flush()
+    return status
+
+
+def _format_error(e):
+    return u'{}: {}'.format(type(e).__name__, e)
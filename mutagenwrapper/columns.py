@@ -0,0 +1,161 @@
+import sys
+from array import array
+from collections import namedtuple
+from functools import partial
+from itertools import izip
+
+from . import MediaFile
+
+
+#: Fields that are extracted into :class:`IntColumn`.
+integer_fields = frozenset(['tracknumber', 'tracktotal',
+                            'discnumber', 'disctotal'])
+
+
+class Table(namedtuple('Table', ['paths', 'columns', 'errors'])):
+    """The result of :func:`extract_columns`. *columns* maps each field
+    to a column whose rows are in the order of *paths*, and *errors* maps
+    the paths of the files that could not be read to the exceptions raised.
+    """
+    __slots__ = ()
+
+
+class IntColumn(object):
+    """A column of integers stored in an :class:`array.array`. *mask* is
+    a bytearray in which the rows with a value are 1; missing values are
+    stored as 0 in *values*.
+    """
+
+    def __init__(self):
+        self.values = array('l')
+        self.mask = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.values.append(0)
+            self.mask.append(0)
+        else:
+            self.values.append(value)
+            self.mask.append(1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i] if self.mask[i] else None
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+class StringColumn(object):
+    """A dictionary-encoded column of strings. Each distinct string is
+    stored once in *dictionary*, and *codes* is an :class:`array.array` of
+    indices into it, one per row. *mask* is a bytearray in which the rows
+    with a value are 1; missing values have the code -1.
+    """
+
+    def __init__(self):
+        self.codes = array('l')
+        self.mask = bytearray()
+        self.dictionary = []
+        self._index = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            self.mask.append(0)
+            return
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self.codes.append(code)
+        self.mask.append(1)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.dictionary[self.codes[i]] if self.mask[i] else None
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+def extract_columns(paths, fields, workers=None, chunksize=64, **options):
+    """Reads *fields* of the files at *paths* into columns and returns
+    a :class:`Table`, without keeping a :class:`~mutagenwrapper.MediaFile`
+    or a dict per file. Fields in :data:`integer_fields` are extracted into
+    :class:`IntColumn` and the others into :class:`StringColumn`. Only the
+    first value of multi-valued tags is kept, and integers too large for
+    an :class:`IntColumn` are missing. Files that cannot be read
+    have all their values missing.
+
+    Files are read in a pool of *workers* processes as in
+    :func:`~mutagenwrapper.scan`, but the rows keep the order of *paths*.
+    *options* are passed to :class:`~mutagenwrapper.MediaFile`.
+    """
+    paths = list(paths)
+    fields = list(fields)
+    if 'picture' in fields:
+        raise ValueError('pictures cannot be extracted into columns')
+    columns = dict((f, IntColumn() if f in integer_fields else StringColumn())
+                   for f in fields)
+    errors = {}
+    func = partial(_extract_one, fields=fields, **options)
+    if workers == 1:
+        results = (func(path) for path in paths)
+        pool = None
+    else:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        results = pool.imap(func, paths, chunksize)
+    try:
+        for path, (values, error) in izip(paths, results):
+            if error is not None:
+                errors[path] = error
+                values = [None] * len(fields)
+            for field, value in zip(fields, values):
+                columns[field].append(value)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return Table(paths, columns, errors)
+
+
+def _extract_one(path, fields, **options):
+    # Errors decoding a field are caught too, so that one malformed file
+    # does not abort the whole extraction
+    try:
+        m = MediaFile(path, fields=fields, **options)
+        values = []
+        for field in fields:
+            try:
+                value = getattr(m.wrapper, field)
+            except AttributeError:
+                value = None
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if value is not None:
+                value = _convert(value, field in integer_fields)
+            values.append(value)
+    except Exception as e:
+        return None, e
+    return values, None
+
+
+def _convert(value, integer):
+    if not integer:
+        return unicode(value)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    # Values that do not fit in an IntColumn are missing
+    if not -sys.maxint - 1 <= value <= sys.maxint:
+        return None
+    return value
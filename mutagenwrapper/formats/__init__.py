@@ -0,0 +1,21 @@
+# Format modules import mutagen and are imported only when they are used.
+# Keep this module free of heavy imports.
+
+
+def read_id3_header(fileobj):
+    """Reads the ID3v2 header at the current position of *fileobj*.
+    Returns a tuple of (major version, flags, tag size), or *None* if
+    there is no ID3v2 tag.
+    """
+    header = fileobj.read(10)
+    if len(header) < 10 or not header.startswith('ID3'):
+        return None
+    return ord(header[3]), ord(header[5]), syncsafe(header[6:10])
+
+
+def syncsafe(data):
+    """Decodes a synchsafe integer used in ID3v2."""
+    value = 0
+    for c in data:
+        value = (value << 7) | (ord(c) & 0x7f)
+    return value
@@ -1,9 +1,13 @@
+import struct
+
 import mutagen.id3
 import mutagen.mp3
 import mutagen.trueaudio
 
 from ..bases import (TagHandler, DefaultTagHandler, PairTagHandler,
                      FreeformTagsWrapper, PrefixFreeformTagMixin, Format)
+from ..pictures import Picture, PictureRef
+from . import read_id3_header, syncsafe
 
 
 class ID3PairTagHandler(PairTagHandler):
@@ -45,18 +49,49 @@ class ID3PairTagHandler(PairTagHandler):
         return '/'.join(new_v)
 
 
+class APIC(mutagen.id3.APIC):
+    """An APIC frame that is encoded once and then reused. mutagen takes
+    frame IDs from class names, hence the name.
+    """
+
+    _encoded = None
+
+    def _writeData(self):
+        if self._encoded is None:
+            self._encoded = super(APIC, self)._writeData()
+        return self._encoded
+
+
+def build_apic(picture):
+    return APIC(encoding=3, mime=picture.mime or '', type=picture.type,
+                desc=picture.description, data=picture)
+
+
 class ID3PictureTagHandler(TagHandler):
 
     def __init__(self, name):
         self.name = name
 
     def __get__(self, obj, type):
-        value = obj.raw.get(self.name)
-        if value:
-            value = value.data
+        value = [Picture(frame.data, mime=frame.mime, type=frame.type,
+                         description=frame.desc)
+                 for key, frame in sorted(obj.raw.items())
+                 if key.startswith(self.name)]
         return self._from_list(value)
 
-    # TODO picture
+    def __set__(self, obj, value):
+        self.__delete__(obj)
+        for v in self._to_list(value):
+            frame = Picture.coerce(v).get_frame('id3', build_apic)
+            obj.raw[frame.HashKey] = frame
+
+    def __delete__(self, obj):
+        for key in obj.raw.keys():
+            if key.startswith(self.name):
+                del obj.raw[key]
+
+    def is_present(self, obj):
+        return any(key.startswith(self.name) for key in obj.raw.keys())
 
 
 class ID3TagSetterMixin(object):
@@ -111,6 +146,61 @@ class ID3CustomTagHandler(PrefixFreeformTagMixin, ID3TextTagHandler):
             obj.raw[self.name].text = value
 
 
+class PaddedID3(mutagen.id3.ID3):
+    """Like :class:`mutagen.id3.ID3`, but reserves at least *padding* bytes
+    of padding whenever the tag has to grow, so that later changes can be
+    written in place.
+    """
+    padding = 1024
+
+    def _prepare_id3_header(self, original_header, framesize, v2_version):
+        header, outsize, insize = super(PaddedID3, self)._prepare_id3_header(
+            original_header, framesize, v2_version)
+        if insize < outsize:
+            outsize = (framesize + self.padding + 1023) & ~0x3ff
+            header = header[:6] + mutagen.id3.BitPaddedInt.to_str(outsize,
+                                                                  width=4)
+        return header, outsize, insize
+
+
+class PaddedMP3(mutagen.mp3.MP3):
+    ID3 = PaddedID3
+
+
+class PaddedTrueAudio(mutagen.trueaudio.TrueAudio):
+    ID3 = PaddedID3
+
+
+class PaddedID3FileType(mutagen.id3.ID3FileType):
+    ID3 = PaddedID3
+
+
+class DiscardedFrames(list):
+    """A list that drops the items appended to it."""
+
+    def append(self, item):
+        pass
+
+
+# The ID3v2.3 frames that mutagen merges into each ID3v2.4 frame when it
+# upgrades a tag. Their ID3v2.2 counterparts derive from them.
+LEGACY_FRAMES = {
+    'TDRC': ('TYER', 'TDAT', 'TIME', 'TRDA'),
+    'TDOR': ('TORY',),
+    'TIPL': ('IPLS',),
+}
+
+
+class ProjectedID3(mutagen.id3.ID3):
+    """Like :class:`mutagen.id3.ID3`, but drops the frames that are not in
+    *known_frames* instead of keeping their raw data around.
+    """
+
+    def load(self, *args, **kwargs):
+        self.unknown_frames = DiscardedFrames()
+        super(ProjectedID3, self).load(*args, **kwargs)
+
+
 class ID3TagsWrapper(FreeformTagsWrapper):
     freeform_tag_handler = ID3CustomTagHandler
 
@@ -139,12 +229,201 @@ class ID3TagsWrapper(FreeformTagsWrapper):
     tracknumber          = ID3PairTagHandler('TRCK', 0)
     tracktotal           = ID3PairTagHandler('TRCK', 1)
 
+    @classmethod
+    def get_handler_name(cls, name):
+        # APIC frames are keyed by their descriptions
+        return 'APIC:' if name.startswith('APIC:') else name
+
 
 class ID3Format(Format):
     name = 'ID3'
     raw_classes = {
-        'mp3': mutagen.mp3.MP3,
-        'mp2': mutagen.mp3.MP3,
-        'tta': mutagen.trueaudio.TrueAudio,
+        'mp3': PaddedMP3,
+        'mp2': PaddedMP3,
+        'tta': PaddedTrueAudio,
+    }
+    # ID3FileType reads the ID3 tag only and ignores the audio stream.
+    tags_classes = {
+        'mp3': PaddedID3FileType,
+        'mp2': PaddedID3FileType,
+        'tta': PaddedID3FileType,
     }
     wrapper_class = ID3TagsWrapper
+    magic = [
+        (0, 'TTA1', 'tta'),
+        (0, 'ID3', 'mp3'),
+    ]
+    padding = 4096
+
+    @classmethod
+    def probe(cls, header):
+        extension = super(ID3Format, cls).probe(header)
+        if extension is None and len(header) >= 2:
+            # MPEG audio frame sync
+            if header[0] == '\xff' and ord(header[1]) & 0xe0 == 0xe0:
+                extension = 'mp3'
+        return extension
+
+    @classmethod
+    def save(cls, raw, padding=None):
+        if raw.tags is None:
+            raw.add_tags()
+        raw.tags.padding = cls.padding if padding is None else padding
+        raw.save()
+
+    @classmethod
+    def load_fields(cls, path, extension, fields, custom_prefix=None):
+        raw_names = cls.wrapper_class.get_raw_names(fields, custom_prefix)
+        ids = set(name.split(':')[0] for name in raw_names)
+        for frame_id in list(ids):
+            ids.update(LEGACY_FRAMES.get(frame_id, ()))
+        known_frames = {}
+        for frame_id, frame in mutagen.id3.Frames.iteritems():
+            if frame_id in ids:
+                known_frames[frame_id] = frame
+        for frame_id, frame in mutagen.id3.Frames_2_2.iteritems():
+            if frame.__base__.__name__ in ids:
+                known_frames[frame_id] = frame
+        return mutagen.id3.ID3FileType(path, ID3=ProjectedID3,
+                                       known_frames=known_frames)
+
+    @classmethod
+    def fetch_tags(cls, fileobj, extension):
+        header = read_id3_header(fileobj)
+        if header is None:
+            # mutagen looks for an ID3v1 tag at the end instead
+            fileobj.seek(-128, 2)
+            fileobj.read(128)
+        else:
+            fileobj.read(header[2])
+
+    @classmethod
+    def tag_regions(cls, fileobj, extension):
+        regions = []
+        header = read_id3_header(fileobj)
+        if header is not None:
+            major, flags, size = header
+            regions.append((0, 10 + size + (10 if flags & 0x10 else 0)))
+        fileobj.seek(0, 2)
+        end = fileobj.tell()
+        if end >= 128:
+            fileobj.seek(end - 128)
+            if fileobj.read(3) == 'TAG':
+                regions.append((end - 128, 128))
+        return regions
+
+    @classmethod
+    def find_pictures(cls, path, extension):
+        with open(path, 'rb') as f:
+            refs = find_id3_pictures(f, path)
+        if refs is None:
+            # The tag cannot be read without decoding it as a whole
+            tags = mutagen.id3.ID3(path)
+            refs = [PictureRef.from_data(frame.data, mime=frame.mime,
+                                         type=frame.type,
+                                         description=frame.desc)
+                    for frame in tags.getall('APIC')]
+        return refs
+
+
+_ID3_MIMES = {'JPG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif'}
+
+
+def find_id3_pictures(fileobj, path):
+    """Returns a list of :class:`~mutagenwrapper.pictures.PictureRef` for
+    the pictures in the ID3v2 tag at the beginning of *fileobj*, reading
+    only the frame headers. Returns *None* if the pictures cannot be located
+    without decoding, i.e. if they are unsynchronized, compressed or
+    encrypted.
+    """
+    header = read_id3_header(fileobj)
+    if header is None:
+        return []
+    major, flags, size = header
+    if major < 4 and flags & 0x80:
+        return None
+    end = 10 + size
+    if flags & 0x40:
+        ext_size, = struct.unpack('>I', fileobj.read(4))
+        if major >= 4:
+            ext_size = syncsafe(struct.pack('>I', ext_size)) - 4
+        fileobj.seek(ext_size, 1)
+    header_size = 6 if major == 2 else 10
+    refs = []
+    while fileobj.tell() + header_size <= end:
+        frame_header = fileobj.read(header_size)
+        if major == 2:
+            frame_id = frame_header[:3]
+            frame_size, = struct.unpack('>I', '\x00' + frame_header[3:6])
+            frame_flags = 0
+        else:
+            frame_id = frame_header[:4]
+            frame_size, frame_flags = struct.unpack('>IH', frame_header[4:])
+            if major >= 4:
+                frame_size = syncsafe(frame_header[4:8])
+        if not frame_id.strip('\x00') or not frame_id.isalnum():
+            break
+        body = fileobj.tell()
+        if body + frame_size > end:
+            break
+        if frame_id in ('APIC', 'PIC'):
+            skip = _frame_prefix_size(major, frame_flags)
+            if skip is None:
+                return None
+            ref = _read_picture_frame(fileobj, path, major, body + skip,
+                                      frame_size - skip)
+            if ref is None:
+                return None
+            refs.append(ref)
+        fileobj.seek(body + frame_size)
+    return refs
+
+
+def _frame_prefix_size(major, flags):
+    # Returns the number of bytes that precede the frame contents, or
+    # None if the contents are not stored verbatim.
+    if major == 3:
+        if flags & 0x00c0:
+            return None
+        return 1 if flags & 0x0020 else 0
+    elif major >= 4:
+        if flags & 0x000e:
+            return None
+        return (1 if flags & 0x0040 else 0) + (4 if flags & 0x0001 else 0)
+    return 0
+
+
+def _read_picture_frame(fileobj, path, major, offset, size):
+    fileobj.seek(offset)
+    head = fileobj.read(min(size, 1024))
+    encoding = ord(head[0])
+    if major == 2:
+        mime = _ID3_MIMES.get(head[1:4].upper())
+        pos = 4
+    else:
+        pos = head.find('\x00', 1)
+        if pos < 0:
+            return None
+        mime = head[1:pos].decode('latin-1')
+        pos += 1
+    type = ord(head[pos])
+    pos += 1
+    if encoding in (1, 2):
+        term = pos
+        while True:
+            term = head.find('\x00\x00', term)
+            if term < 0 or (term - pos) % 2 == 0:
+                break
+            term += 1
+        codec = 'utf-16' if encoding == 1 else 'utf-16-be'
+        width = 2
+    else:
+        term = head.find('\x00', pos)
+        codec = 'latin-1' if encoding == 0 else 'utf-8'
+        width = 1
+    if term < 0:
+        return None
+    description = head[pos:term].decode(codec, 'replace')
+    pos = term + width
+    return PictureRef(path, offset + pos, size - pos, mime=mime, type=type,
+                      description=description)
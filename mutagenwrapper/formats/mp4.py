@@ -1,7 +1,10 @@
+import struct
+
 import mutagen.mp4
 
 from ..bases import (TagHandler, DefaultTagHandler, PairTagHandler,
                      FreeformTagsWrapper, PrefixFreeformTagMixin, Format)
+from ..pictures import Picture, PictureRef
 
 
 class MP4PairTagHandler(PairTagHandler):
@@ -31,6 +34,24 @@ class MP4CustomTagHandler(PrefixFreeformTagMixin, DefaultTagHandler):
         obj.raw[self.name] = [v.encode('utf-8') for v in value]
 
 
+def build_cover(picture):
+    if picture.mime == 'image/png':
+        return mutagen.mp4.MP4Cover(picture, mutagen.mp4.MP4Cover.FORMAT_PNG)
+    return mutagen.mp4.MP4Cover(picture, mutagen.mp4.MP4Cover.FORMAT_JPEG)
+
+
+class MP4PictureTagHandler(DefaultTagHandler):
+
+    def __get__(self, obj, type):
+        value = [Picture(v, mime=_COVER_MIMES.get(v.imageformat))
+                 for v in obj.raw.get(self.name, [])]
+        return self._from_list(value)
+
+    def __set__(self, obj, value):
+        obj.raw[self.name] = [Picture.coerce(v).get_frame('mp4', build_cover)
+                              for v in self._to_list(value)]
+
+
 class MP4TagsWrapper(FreeformTagsWrapper):
     freeform_tag_handler = MP4CustomTagHandler
 
@@ -56,20 +77,179 @@ class MP4TagsWrapper(FreeformTagsWrapper):
     # written by foobar2000. Note that foobar2000 ignores
     # multiple values written by mutagen for any tag, not just covr,
     # and uses just the last value.
-    picture              = DefaultTagHandler('covr')
+    picture              = MP4PictureTagHandler('covr')
     title                = DefaultTagHandler('\xa9nam')
     titlesortorder       = DefaultTagHandler('sonm')
     tracknumber          = MP4PairTagHandler('trkn', 0)
     tracktotal           = MP4PairTagHandler('trkn', 1)
 
 
+class PaddedMP4Tags(mutagen.mp4.MP4Tags):
+    """Like :class:`mutagen.mp4.MP4Tags`, but reserves at least *padding*
+    bytes in a ``free`` atom whenever the ``ilst`` atom has to grow, so that
+    later changes can be written in place.
+    """
+    padding = 1024
+
+    # Overrides the private method that renders the padding after ilst
+    def _MP4Tags__pad_ilst(self, data, length=None):
+        if length is None:
+            length = (((len(data) + self.padding + 1023) & ~1023) -
+                      len(data))
+        return mutagen.mp4.Atom.render('free', '\x00' * length)
+
+
+class PaddedMP4(mutagen.mp4.MP4):
+    MP4Tags = PaddedMP4Tags
+
+
+class MP4TagsOnly(PaddedMP4):
+    """Like :class:`mutagen.mp4.MP4`, but reads the ``ilst`` atom only
+    and does not look into the audio tracks. If *atom_names* is given,
+    the other atoms in ``ilst`` are skipped.
+    """
+
+    def load(self, filename, atom_names=None):
+        self.filename = filename
+        with open(filename, 'rb') as fileobj:
+            atoms = mutagen.mp4.Atoms(fileobj)
+            if not atoms.atoms or atoms.atoms[0].name != 'ftyp':
+                raise mutagen.mp4.error('Not a MP4 file')
+            if mutagen.mp4.MP4Tags._can_load(atoms):
+                if atom_names is not None:
+                    ilst = atoms['moov.udta.meta.ilst']
+                    ilst.children = [atom for atom in ilst.children
+                                     if atom.name in atom_names]
+                self.tags = self.MP4Tags(atoms, fileobj)
+            else:
+                self.tags = None
+
+
 class MP4Format(Format):
     name = 'MP4'
     raw_classes = {
-        'm4a': mutagen.mp4.MP4,
-        'm4b': mutagen.mp4.MP4,
-        'm4p': mutagen.mp4.MP4,
-        'm4v': mutagen.mp4.MP4,
-        'mp4': mutagen.mp4.MP4,
+        'm4a': PaddedMP4,
+        'm4b': PaddedMP4,
+        'm4p': PaddedMP4,
+        'm4v': PaddedMP4,
+        'mp4': PaddedMP4,
     }
+    tags_classes = dict.fromkeys(raw_classes, MP4TagsOnly)
     wrapper_class = MP4TagsWrapper
+    magic = [
+        (4, 'ftypM4B', 'm4b'),
+        (4, 'ftypM4P', 'm4p'),
+        (4, 'ftypM4V', 'm4v'),
+        (4, 'ftyp', 'm4a'),
+    ]
+    padding = 4096
+
+    @classmethod
+    def save(cls, raw, padding=None):
+        if raw.tags is None:
+            raw.add_tags()
+        raw.tags.padding = cls.padding if padding is None else padding
+        raw.save()
+
+    @classmethod
+    def load_fields(cls, path, extension, fields, custom_prefix=None):
+        # Freeform names look like "----:mean:name"
+        atom_names = set(name[:4] for name in cls.wrapper_class.get_raw_names(
+            fields, custom_prefix))
+        return MP4TagsOnly(path, atom_names=atom_names)
+
+    @classmethod
+    def fetch_tags(cls, fileobj, extension):
+        fileobj.seek(0, 2)
+        fetch_mp4_tags(fileobj, 0, fileobj.tell())
+
+    @classmethod
+    def tag_regions(cls, fileobj, extension):
+        fileobj.seek(0, 2)
+        ilst = find_atom(fileobj, ('moov', 'udta', 'meta', 'ilst'),
+                         0, fileobj.tell())
+        if ilst is None:
+            return []
+        offset, header, size = ilst
+        return [(offset, size)]
+
+    @classmethod
+    def find_pictures(cls, path, extension):
+        refs = []
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            covr = find_atom(f, ('moov', 'udta', 'meta', 'ilst', 'covr'),
+                             0, f.tell())
+            if covr is None:
+                return refs
+            offset, header, size = covr
+            for name, offset, header, size in iter_atoms(
+                    f, offset + header, offset + size):
+                if name != 'data':
+                    continue
+                f.seek(offset + header)
+                flags, = struct.unpack('>I4x', f.read(8))
+                refs.append(PictureRef(path, offset + header + 8,
+                                       size - header - 8,
+                                       mime=_COVER_MIMES.get(flags)))
+        return refs
+
+
+_COVER_MIMES = {
+    mutagen.mp4.MP4Cover.FORMAT_JPEG: 'image/jpeg',
+    mutagen.mp4.MP4Cover.FORMAT_PNG: 'image/png',
+}
+
+
+def iter_atoms(fileobj, start, end):
+    """Iterates (name, offset, header size, size) of the atoms between
+    *start* and *end* in *fileobj*, reading only the atom headers.
+    """
+    pos = start
+    while pos + 8 <= end:
+        fileobj.seek(pos)
+        size, name = struct.unpack('>I4s', fileobj.read(8))
+        header = 8
+        if size == 1:
+            size, = struct.unpack('>Q', fileobj.read(8))
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield name, pos, header, size
+        pos += size
+
+
+def fetch_mp4_tags(fileobj, start, end, ilst=False):
+    """Reads the headers of the atoms that mutagen walks through, which are
+    the atoms between *start* and *end* and the children of containers,
+    and the contents of the atoms in ``ilst``.
+    """
+    for name, offset, header, size in iter_atoms(fileobj, start, end):
+        if ilst:
+            fileobj.seek(offset)
+            fileobj.read(size)
+        elif name in mutagen.mp4._CONTAINERS:
+            skip = mutagen.mp4._SKIP_SIZE.get(name, 0)
+            fetch_mp4_tags(fileobj, offset + header + skip, offset + size,
+                           name == 'ilst')
+
+
+def find_atom(fileobj, names, start, end):
+    """Returns (offset, header size, size) of the atom at the path given
+    by *names*, or *None* if there is no such atom.
+    """
+    found = None
+    for name in names:
+        for atom in iter_atoms(fileobj, start, end):
+            if atom[0] == name:
+                break
+        else:
+            return None
+        found = atom[1:]
+        offset, header, size = found
+        # meta is a full atom with four bytes of version and flags
+        start = offset + header + (4 if name == 'meta' else 0)
+        end = offset + size
+    return found
@@ -1,4 +1,10 @@
+import base64
+import struct
+from io import BytesIO
+
+import mutagen._vorbis
 import mutagen.flac
+import mutagen.ogg
 import mutagen.oggflac
 import mutagen.oggspeex
 import mutagen.oggtheora
@@ -6,6 +12,8 @@ import mutagen.oggvorbis
 
 from ..bases import TagHandler, DefaultTagHandler, TagsWrapper, Format
 from ..exceptions import ReservedTagNameError
+from ..pictures import Picture, PictureRef
+from . import read_id3_header
 
 
 class VorbisIntegerTagHandler(DefaultTagHandler):
@@ -25,32 +33,168 @@ class VorbisIntegerTagHandler(DefaultTagHandler):
         obj.raw[self.name] = value
 
 
-# TODO ogg files don't have pictures but byte64-encoded metadata_block_picture
-# in Vorbis comment.
+class EncodedPicture(mutagen.flac.Picture):
+    """A FLAC picture block that is encoded once and then reused."""
+
+    _encoded = None
+
+    def write(self):
+        if self._encoded is None:
+            self._encoded = super(EncodedPicture, self).write()
+        return self._encoded
+
+
+def build_flac_picture(picture):
+    block = EncodedPicture()
+    block.type = picture.type
+    block.mime = picture.mime or u''
+    block.desc = picture.description
+    block.width = picture.width or 0
+    block.height = picture.height or 0
+    block.data = picture
+    return block
+
+
+def build_vorbis_picture(picture):
+    # Ogg files keep pictures base64-encoded in Vorbis comments. Being
+    # ASCII, the value is kept as a byte string, which mutagen writes as is.
+    block = picture.get_frame('flac', build_flac_picture)
+    return base64.b64encode(block.write())
+
+
+def _from_flac_picture(block):
+    return Picture(block.data, mime=block.mime, type=block.type,
+                   description=block.desc, width=block.width,
+                   height=block.height)
+
+
+class Base64Data(object):
+    """The data encoded in the base64 string *encoded*, or *length* bytes
+    of it from *offset*. Only the part of the string that a slice covers
+    is decoded.
+    """
+
+    def __init__(self, encoded, offset=0, length=None):
+        self.encoded = encoded
+        self.offset = offset
+        if length is None:
+            padding = len(encoded) - len(encoded.rstrip('='))
+            length = len(encoded) // 4 * 3 - padding - offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self.length)
+        if stop <= start:
+            return ''
+        start += self.offset
+        stop += self.offset
+        # Every 4 characters encode 3 bytes
+        first = start // 3
+        last = (stop + 2) // 3
+        data = base64.b64decode(self.encoded[first * 4:last * 4])
+        return data[start - first * 3:stop - first * 3]
+
+
+def decode_picture_comment(encoded):
+    """Decodes the header of the FLAC picture block in the base64 string
+    *encoded*, and returns a :class:`~mutagenwrapper.pictures.PictureRef`
+    whose image data is decoded only as it is read.
+    """
+    data = Base64Data(encoded)
+    type, length = struct.unpack('>2I', data[0:8])
+    mime = data[8:8 + length]
+    pos = 8 + length
+    length, = struct.unpack('>I', data[pos:pos + 4])
+    desc = data[pos + 4:pos + 4 + length].decode('utf-8', 'replace')
+    pos += 4 + length
+    width, height, depth, colors, length = struct.unpack(
+        '>5I', data[pos:pos + 20])
+    image = Base64Data(encoded, data.offset + pos + 20, length)
+    return PictureRef.from_data(image, mime=mime, type=type,
+                                description=desc, width=width, height=height)
+
+
+def _from_picture_comment(encoded):
+    return Picture.from_ref(decode_picture_comment(encoded))
+
+
 class VorbisPictureTagHandler(TagHandler):
 
+    # The comment that holds the pictures of Ogg files
+    comment_name = 'metadata_block_picture'
+
     def __get__(self, obj, type):
-        value = [p.data for p in obj.raw.pictures]
-        return self._from_list(value)
+        if hasattr(obj.raw, 'pictures'):
+            sources = list(obj.raw.pictures)
+            decode = _from_flac_picture
+        else:
+            sources = list(obj.raw.get(self.comment_name, []))
+            decode = _from_picture_comment
+        # The pictures are decoded once, and again only if the blocks or
+        # comments they were decoded from are replaced
+        cached = obj.__dict__.get('_decoded_pictures')
+        if (cached is not None and len(cached[0]) == len(sources) and
+                all(a is b for a, b in zip(cached[0], sources))):
+            value = cached[1]
+        else:
+            value = [decode(v) for v in sources]
+            obj.__dict__['_decoded_pictures'] = (sources, value)
+        return self._from_list(list(value))
 
-    # TODO add abstract picture class that unifies
-    # mutagen.flac.Picture, mutagen.mp4.MP4Cover,
-    # mutagen.id3.APIC. The code below works only if
-    # value is an instance of mutagen.flac.Picture, breaking
-    # the symmetry (__get__() returns the raw image data).
-    # def __set__(self, obj, value):
-    #     value = self._to_list(value)
-    #     obj.raw.clear_pictures()
-    #     for v in value:
-    #         obj.raw.add_picture(v)
+    def __set__(self, obj, value):
+        obj.__dict__.pop('_decoded_pictures', None)
+        pictures = [Picture.coerce(v) for v in self._to_list(value)]
+        if hasattr(obj.raw, 'pictures'):
+            obj.raw.clear_pictures()
+            for p in pictures:
+                obj.raw.add_picture(p.get_frame('flac', build_flac_picture))
+        elif pictures:
+            obj.raw[self.comment_name] = [
+                p.get_frame('vorbis', build_vorbis_picture) for p in pictures]
+        else:
+            self.__delete__(obj)
 
     def __delete__(self, obj):
-        obj.raw.clear_pictures()
+        obj.__dict__.pop('_decoded_pictures', None)
+        if hasattr(obj.raw, 'pictures'):
+            obj.raw.clear_pictures()
+        elif self.comment_name in obj.raw:
+            del obj.raw[self.comment_name]
+
+
+class SkippedPicture(mutagen.flac.MetadataBlock):
+    """A PICTURE block whose image data is skipped instead of being read."""
+    _distrust_size = True
+
+    def __init__(self, fileobj):
+        type, length = struct.unpack('>II', fileobj.read(8))
+        fileobj.seek(length, 1)
+        length, = struct.unpack('>I', fileobj.read(4))
+        fileobj.seek(length + 16, 1)
+        length, = struct.unpack('>I', fileobj.read(4))
+        fileobj.seek(length, 1)
+
+
+class FLACWithoutPictures(mutagen.flac.FLAC):
+    """Like :class:`mutagen.flac.FLAC`, but skips the image data in
+    PICTURE blocks.
+    """
+    METADATA_BLOCKS = list(mutagen.flac.FLAC.METADATA_BLOCKS)
+    METADATA_BLOCKS[mutagen.flac.Picture.code] = SkippedPicture
 
 
 class VorbisTagsWrapper(TagsWrapper):
     case_insensitive = True
 
+    def __init__(self, raw, fields=None, case_insensitive=None,
+                 custom_prefix=None):
+        # Vorbis comment names are case-insensitive regardless of the option
+        super(VorbisTagsWrapper, self).__init__(raw, fields, True,
+                                                custom_prefix)
+
     album                = DefaultTagHandler('album')
     albumartist          = DefaultTagHandler('albumartist')
     albumartistsortorder = DefaultTagHandler('albumartistsortorder')
@@ -80,28 +224,319 @@ class VorbisTagsWrapper(TagsWrapper):
         for name, value in self.raw.iteritems():
             if not value:
                 continue
-            if name in cls.__lut__:
+            if name == VorbisPictureTagHandler.comment_name:
+                yield 'picture'
+            elif name in cls.__lut__:
                 yield name
             else:
-                yield cls.custom_prefix + name
-        if hasattr(self.raw, 'pictures'):
+                yield self.custom_prefix + name
+        if getattr(self.raw, 'pictures', None):
             yield 'picture'
 
-    def get_custom_tag_handler(self, name):
-        cls = self.__class__
-        name = name[len(cls.custom_prefix):]
+    @classmethod
+    def get_custom_tag_handler(cls, name):
         if name in cls.__lut__:
             raise ReservedTagNameError
         return DefaultTagHandler(name)
 
 
+class PictureCommentsMixin(object):
+    """Keeps the base64-encoded pictures in Vorbis comments as byte strings,
+    instead of decoding them into unicode strings four times their size with
+    the other comments. They are dropped if :attr:`skip_pictures` is *True*.
+    The pictures come after the other comments when the tags are saved.
+    """
+
+    skip_pictures = False
+
+    def load(self, fileobj, errors='replace', framing=True):
+        self.load_comments(fileobj.read(), errors, framing)
+
+    def load_comments(self, data, errors='replace', framing=True):
+        try:
+            data, pictures = _split_picture_comments(data,
+                                                     self.skip_pictures)
+        except struct.error:
+            # Leaves it to mutagen to report the error
+            pictures = []
+        mutagen._vorbis.VComment.load(self, BytesIO(data), errors, framing)
+        for value in pictures:
+            self.append((VorbisPictureTagHandler.comment_name, value))
+
+
+def _split_picture_comments(data, skip):
+    """Returns the comment packet *data* without the pictures, and a list
+    of the pictures, which is empty if *skip* is *True*.
+    """
+    name = VorbisPictureTagHandler.comment_name + '='
+    vendor_length, = struct.unpack('<I', data[:4])
+    pos = 4 + vendor_length
+    count, = struct.unpack('<I', data[pos:pos + 4])
+    pos += 4
+    comments = []
+    pictures = []
+    for i in xrange(count):
+        length, = struct.unpack('<I', data[pos:pos + 4])
+        end = pos + 4 + length
+        if data[pos + 4:pos + 4 + len(name)].lower() != name:
+            comments.append(data[pos:end])
+        elif not skip:
+            pictures.append(data[pos + 4 + len(name):end])
+        pos = end
+    if len(comments) == count:
+        return data, pictures
+    header = data[:4 + vendor_length] + struct.pack('<I', len(comments))
+    return header + ''.join(comments) + data[pos:], pictures
+
+
+class OggVorbisComments(PictureCommentsMixin,
+                        mutagen.oggvorbis.OggVCommentDict):
+    pass
+
+
+class OggFLACComments(PictureCommentsMixin, mutagen.oggflac.OggFLACVComment):
+
+    def load(self, fileobj, info, errors='replace'):
+        # As OggFLACVComment.load(), which reads the packet itself
+        pages = []
+        complete = False
+        while not complete:
+            page = mutagen.ogg.OggPage(fileobj)
+            if page.serial == info.serial:
+                pages.append(page)
+                complete = page.complete or len(page.packets) > 1
+        packet = mutagen.ogg.OggPage.to_packets(pages)[0]
+        self.load_comments(packet[4:], errors, framing=False)
+
+
+class OggSpeexComments(PictureCommentsMixin,
+                       mutagen.oggspeex.OggSpeexVComment):
+    pass
+
+
+class OggTheoraComments(PictureCommentsMixin,
+                        mutagen.oggtheora.OggTheoraCommentDict):
+    pass
+
+
+class OggVorbis(mutagen.oggvorbis.OggVorbis):
+    _Tags = OggVorbisComments
+
+
+class OggFLAC(mutagen.oggflac.OggFLAC):
+    _Tags = OggFLACComments
+
+
+class OggSpeex(mutagen.oggspeex.OggSpeex):
+    _Tags = OggSpeexComments
+
+
+class OggTheora(mutagen.oggtheora.OggTheora):
+    _Tags = OggTheoraComments
+
+
+class OggTagsOnlyMixin(object):
+    """Skips reading the last page of the stream, which is needed only
+    to calculate the length of the stream, when loading an Ogg file.
+    """
+
+    def load(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fileobj:
+            try:
+                self.info = self._Info(fileobj)
+                self.tags = self._Tags(fileobj, self.info)
+            except mutagen.ogg.error as e:
+                raise self._Error(e)
+            except EOFError:
+                raise self._Error('no appropriate stream found')
+
+
+class OggVorbisTagsOnly(OggTagsOnlyMixin, OggVorbis):
+    pass
+
+
+class OggFLACTagsOnly(OggTagsOnlyMixin, OggFLAC):
+    pass
+
+
+class OggSpeexTagsOnly(OggTagsOnlyMixin, OggSpeex):
+    pass
+
+
+class OggTheoraTagsOnly(OggTagsOnlyMixin, OggTheora):
+    pass
+
+
+def _without_pictures(filetype):
+    """Returns a subclass of the Ogg *filetype* that skips the pictures."""
+    tags = type(filetype._Tags.__name__, (filetype._Tags,),
+                {'skip_pictures': True})
+    return type(filetype.__name__, (filetype,), {'_Tags': tags})
+
+
 class VorbisFormat(Format):
     name = 'Vorbis'
     raw_classes = {
         'flac': mutagen.flac.FLAC,
-        'ogg': mutagen.oggvorbis.OggVorbis,
-        'oggflac': mutagen.oggflac.OggFLAC,
-        'oggspeex': mutagen.oggspeex.OggSpeex,
-        'oggtheora': mutagen.oggtheora.OggTheora,
+        'ogg': OggVorbis,
+        'oggflac': OggFLAC,
+        'oggspeex': OggSpeex,
+        'oggtheora': OggTheora,
+    }
+    # FLAC keeps stream information in a metadata block, which is read
+    # along with the tags anyway.
+    tags_classes = {
+        'flac': mutagen.flac.FLAC,
+        'ogg': OggVorbisTagsOnly,
+        'oggflac': OggFLACTagsOnly,
+        'oggspeex': OggSpeexTagsOnly,
+        'oggtheora': OggTheoraTagsOnly,
     }
+    # Used to read fields other than pictures
+    ogg_classes_without_pictures = dict(
+        (extension, _without_pictures(filetype))
+        for extension, filetype in tags_classes.iteritems()
+        if extension != 'flac')
     wrapper_class = VorbisTagsWrapper
+    magic = [
+        (0, 'fLaC', 'flac'),
+    ]
+    # The first packet of a logical stream identifies the codec
+    ogg_magic = [
+        ('\x01vorbis', 'ogg'),
+        ('\x7fFLAC', 'oggflac'),
+        ('Speex   ', 'oggspeex'),
+        ('\x80theora', 'oggtheora'),
+    ]
+    padding = 4096
+
+    @classmethod
+    def probe(cls, header):
+        if header.startswith('OggS') and len(header) > 27:
+            packet = header[27 + ord(header[26]):]
+            for magic, extension in cls.ogg_magic:
+                if packet.startswith(magic):
+                    return extension
+            return None
+        return super(VorbisFormat, cls).probe(header)
+
+    @classmethod
+    def save(cls, raw, padding=None):
+        if padding is None:
+            padding = cls.padding
+        if isinstance(raw, mutagen.flac.FLAC):
+            # mutagen appends 1020 bytes of padding, merges all padding
+            # blocks and shrinks the result if the blocks fit in place.
+            block = mutagen.flac.Padding()
+            block.length = max(0, padding - 1020)
+            raw.metadata_blocks.append(block)
+        raw.save()
+
+    @classmethod
+    def saves_in_place(cls, extension):
+        # mutagen rewrites the pages after the comment packet of Ogg files
+        return extension == 'flac'
+
+    @classmethod
+    def load_fields(cls, path, extension, fields, custom_prefix=None):
+        if 'picture' in fields:
+            return cls.tags_classes[extension](path)
+        elif extension == 'flac':
+            return FLACWithoutPictures(path)
+        return cls.ogg_classes_without_pictures[extension](path)
+
+    @classmethod
+    def fetch_tags(cls, fileobj, extension):
+        if extension != 'flac':
+            fetch_ogg_headers(fileobj)
+            return
+        for code, offset, size in iter_flac_blocks(fileobj):
+            fileobj.read(size)
+
+    @classmethod
+    def tag_regions(cls, fileobj, extension):
+        if extension != 'flac':
+            # The pages up to the end of the comment packet
+            fetch_ogg_headers(fileobj)
+            return [(0, fileobj.tell())]
+        return [(offset, size) for code, offset, size
+                in iter_flac_blocks(fileobj)
+                if code in (mutagen.flac.VCFLACDict.code,
+                            mutagen.flac.Picture.code)]
+
+    @classmethod
+    def find_pictures(cls, path, extension):
+        if extension == 'flac':
+            with open(path, 'rb') as f:
+                return find_flac_pictures(f, path)
+        # Ogg files keep pictures base64-encoded in Vorbis comments
+        raw = cls.tags_classes[extension](path)
+        return [decode_picture_comment(value) for value in
+                raw.get(VorbisPictureTagHandler.comment_name, [])]
+
+
+def iter_flac_blocks(fileobj):
+    """Iterates (block type, offset, size) of the metadata blocks in
+    a FLAC file, reading only the block headers. *offset* is where
+    the contents of the block start.
+    """
+    header = read_id3_header(fileobj)
+    if header is None:
+        fileobj.seek(0)
+    else:
+        major, flags, size = header
+        fileobj.seek(10 + size + (10 if flags & 0x10 else 0))
+    if fileobj.read(4) != 'fLaC':
+        raise mutagen.flac.FLACNoHeaderError('not a FLAC file')
+    last = False
+    while not last:
+        header = fileobj.read(4)
+        if len(header) < 4:
+            break
+        code = ord(header[0]) & 0x7f
+        last = ord(header[0]) & 0x80
+        size, = struct.unpack('>I', '\x00' + header[1:])
+        offset = fileobj.tell()
+        yield code, offset, size
+        fileobj.seek(offset + size)
+
+
+def fetch_ogg_headers(fileobj):
+    """Reads the pages of an Ogg file up to the end of the second packet,
+    which holds the comments, of the first logical stream.
+    """
+    serial = None
+    packets = 0
+    while packets < 2:
+        header = fileobj.read(27)
+        if len(header) < 27 or not header.startswith('OggS'):
+            break
+        lacing = fileobj.read(ord(header[26]))
+        fileobj.read(sum(ord(c) for c in lacing))
+        if serial is None:
+            serial = header[14:18]
+        if header[14:18] == serial:
+            # A lacing value under 255 ends a packet
+            packets += sum(1 for c in lacing if ord(c) < 255)
+
+
+def find_flac_pictures(fileobj, path):
+    """Returns a list of :class:`~mutagenwrapper.pictures.PictureRef` for
+    the PICTURE blocks in a FLAC file, without reading the image data.
+    """
+    refs = []
+    for code, offset, size in iter_flac_blocks(fileobj):
+        if code != mutagen.flac.Picture.code:
+            continue
+        fileobj.seek(offset)
+        type, length = struct.unpack('>II', fileobj.read(8))
+        mime = fileobj.read(length).decode('utf-8', 'replace')
+        length, = struct.unpack('>I', fileobj.read(4))
+        description = fileobj.read(length).decode('utf-8', 'replace')
+        width, height, depth, colors, length = struct.unpack(
+            '>5I', fileobj.read(20))
+        refs.append(PictureRef(path, fileobj.tell(), length, mime=mime,
+                               type=type, description=description,
+                               width=width, height=height))
+    return refs
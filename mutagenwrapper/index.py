@@ -0,0 +1,154 @@
+import json
+import os
+from collections import namedtuple
+
+from .scanner import iter_paths, scan
+
+
+class UpdateResult(namedtuple('UpdateResult',
+                              ['updated', 'unchanged', 'removed', 'failed'])):
+    """The number of files handled in each way by
+    :meth:`LibraryIndex.update`. *failed* files are also counted in
+    *updated*.
+    """
+    __slots__ = ()
+
+
+class LibraryIndex(object):
+    """A persistent index of the tags in a library, stored in an SQLite
+    database at *path*. Each file is recorded together with its size,
+    modification time and inode number, and is read again only when
+    one of them changes.
+    """
+
+    #: The number of files to write between commits during an update.
+    batch_size = 1000
+
+    def __init__(self, path):
+        # Imported here to keep importing the package cheap
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                          'path TEXT PRIMARY KEY, '
+                          'size INTEGER, mtime REAL, inode INTEGER, '
+                          'tags TEXT, error TEXT)')
+        self.conn.commit()
+
+    def update(self, roots, workers=None, **options):
+        """Brings the index up to date with the files under *roots*,
+        which may be a single path or a list of paths. Files that are new
+        or have changed are read with :func:`~mutagenwrapper.scan`
+        using *workers* and *options*, and files that no longer exist
+        are removed from the index. Returns an :class:`UpdateResult`.
+        """
+        if isinstance(roots, basestring):
+            roots = [roots]
+        known = dict((row[0], tuple(row[1:])) for row in self.conn.execute(
+            'SELECT path, size, mtime, inode FROM files'))
+        seen = set()
+        stale = {}
+        for path in iter_paths(roots):
+            seen.add(path)
+            try:
+                signature = _stat_signature(path)
+            except OSError:
+                continue
+            if known.get(path) != signature:
+                stale[path] = signature
+        removed = [p for p in known if p not in seen and _is_under(p, roots)]
+        updated = failed = 0
+        if stale:
+            for result in scan(list(stale), workers, **options):
+                if result.error is not None:
+                    failed += 1
+                self._put(result, stale[result.path])
+                updated += 1
+                if updated % self.batch_size == 0:
+                    self.conn.commit()
+        self.conn.executemany('DELETE FROM files WHERE path = ?',
+                              [(p,) for p in removed])
+        self.conn.commit()
+        unchanged = len(seen) - len(stale)
+        return UpdateResult(updated, unchanged, len(removed), failed)
+
+    def get(self, path, default=None):
+        """Returns the tags of the file at *path* as a dict, or *default*
+        if the file is not in the index or could not be read.
+        """
+        row = self.conn.execute('SELECT tags FROM files WHERE path = ?',
+                                (path,)).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return json.loads(row[0])
+
+    def error(self, path):
+        """Returns the error message recorded while reading the file at
+        *path*, or *None* if there was no error.
+        """
+        row = self.conn.execute('SELECT error FROM files WHERE path = ?',
+                                (path,)).fetchone()
+        return row[0] if row else None
+
+    def paths(self):
+        """Returns a list of the paths in the index."""
+        return [row[0] for row in
+                self.conn.execute('SELECT path FROM files ORDER BY path')]
+
+    def iteritems(self):
+        """Iterates (path, tags) pairs of the files that could be read."""
+        cursor = self.conn.execute('SELECT path, tags FROM files '
+                                   'WHERE tags IS NOT NULL ORDER BY path')
+        for path, tags in cursor:
+            yield path, json.loads(tags)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __contains__(self, path):
+        return self.conn.execute('SELECT 1 FROM files WHERE path = ?',
+                                 (path,)).fetchone() is not None
+
+    def _put(self, result, signature):
+        if result.error is None:
+            tags = json.dumps(encode_tags(result.tags), sort_keys=True)
+            error = None
+        else:
+            tags = None
+            error = u'{}: {}'.format(type(result.error).__name__,
+                                     result.error)
+        self.conn.execute('INSERT OR REPLACE INTO files '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+                          (result.path,) + signature + (tags, error))
+
+
+def encode_tags(tags):
+    """Returns a copy of *tags* without binary values such as pictures,
+    which cannot be represented in JSON.
+    """
+    ret = {}
+    for key, value in tags.iteritems():
+        values = value if isinstance(value, list) else [value]
+        if not any(isinstance(v, str) for v in values):
+            ret[key] = value
+    return ret
+
+
+def _stat_signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime, st.st_ino)
+
+
+def _is_under(path, roots):
+    for root in roots:
+        if path == root or path.startswith(os.path.join(root, '')):
+            return True
+    return False
@@ -0,0 +1,185 @@
+import bisect
+from collections import namedtuple
+
+from .index import encode_tags
+
+
+class Page(namedtuple('Page', ['ids', 'cursor'])):
+    """A page of results of :meth:`Library.page`. *ids* are the IDs of the
+    tracks in order, and *cursor* is passed to :meth:`Library.page` to get
+    the next page, or is *None* if this is the last page.
+    """
+    __slots__ = ()
+
+
+class Library(object):
+    """An in-memory index of the tags of tracks, which finds the tracks
+    with given values through inverted indexes from each value to the
+    tracks that have it, without looking at the other tracks.
+
+    *items* is an iterable of (path, tags) pairs to add, such as
+    :meth:`LibraryIndex.iteritems() <mutagenwrapper.LibraryIndex.iteritems>`.
+    Each track is given an integer ID, which is not reused. Strings are
+    matched case-insensitively, and each value of a multi-valued tag is
+    matched on its own. Binary values such as pictures are not kept.
+    """
+
+    #: If a query matches at most this fraction of the tracks,
+    #: :meth:`page` sorts the matches instead of walking the sorted tracks.
+    sort_ratio = 0.01
+
+    def __init__(self, items=()):
+        self._paths = []
+        self._tags = []
+        self._ids = {}
+        self._index = {}
+        self._orders = {}
+        for path, tags in items:
+            self.add(path, tags)
+
+    def add(self, path, tags):
+        """Adds the track at *path* with the dict *tags*, replacing the
+        track at the same path if there is one, and returns its ID.
+        """
+        self.remove(path)
+        tags = encode_tags(tags)
+        id = len(self._paths)
+        self._paths.append(path)
+        self._tags.append(tags)
+        self._ids[path] = id
+        for field, values in tags.iteritems():
+            index = self._index.setdefault(field, {})
+            for value in _keys(values):
+                index.setdefault(value, set()).add(id)
+        for sort, order in self._orders.iteritems():
+            bisect.insort(order, (self._sort_key(id, sort), id))
+        return id
+
+    def remove(self, path):
+        """Removes the track at *path*, if there is one."""
+        id = self._ids.pop(path, None)
+        if id is None:
+            return
+        for field, values in self._tags[id].iteritems():
+            index = self._index[field]
+            for value in _keys(values):
+                ids = index[value]
+                ids.discard(id)
+                if not ids:
+                    del index[value]
+        for sort, order in self._orders.iteritems():
+            del order[bisect.bisect_left(order, (self._sort_key(id, sort),
+                                                 id))]
+        self._paths[id] = self._tags[id] = None
+
+    def get(self, id):
+        """Returns the tags of the track with *id*."""
+        tags = self._tags[id]
+        if tags is None:
+            raise KeyError(id)
+        return tags
+
+    def path(self, id):
+        """Returns the path of the track with *id*."""
+        path = self._paths[id]
+        if path is None:
+            raise KeyError(id)
+        return path
+
+    def values(self, field):
+        """Returns a dict of the values of *field*, in lower case for
+        strings, to the number of tracks with each of them.
+        """
+        return dict((value, len(ids)) for value, ids
+                    in self._index.get(field, {}).iteritems())
+
+    def find(self, **criteria):
+        """Returns a sorted list of the IDs of the tracks whose tags have
+        all the values in *criteria*, e.g. ``find(artist=u'X', genre=u'Y')``.
+        """
+        return sorted(self._match(criteria))
+
+    def page(self, sort, limit, cursor=None, **criteria):
+        """Returns a :class:`Page` of at most *limit* tracks that match
+        *criteria* as in :meth:`find`, sorted by the field *sort* or
+        a tuple of fields, and starting after *cursor*. Where a track has
+        the ``sortorder`` field of a sort field, e.g. ``artistsortorder`` for
+        ``artist``, that is used instead. Tracks without a field come last.
+        """
+        if isinstance(sort, basestring):
+            sort = (sort,)
+        sort = tuple(sort)
+        if criteria:
+            ids = self._match(criteria)
+            if len(ids) <= self.sort_ratio * len(self._ids):
+                keys = sorted((self._sort_key(id, sort), id) for id in ids)
+                return self._page(keys, limit, cursor, None)
+        else:
+            ids = None
+        return self._page(self._get_order(sort), limit, cursor, ids)
+
+    def _match(self, criteria):
+        postings = []
+        for field, value in criteria.iteritems():
+            ids = self._index.get(field, {}).get(_key(value))
+            if not ids:
+                return set()
+            postings.append(ids)
+        if not postings:
+            return set(self._ids.itervalues())
+        postings.sort(key=len)
+        ids = set(postings[0])
+        for other in postings[1:]:
+            ids.intersection_update(other)
+            if not ids:
+                break
+        return ids
+
+    def _page(self, keys, limit, cursor, ids):
+        # keys is a sorted list of (sort key, id), of which those in ids
+        # (or all if None) are returned
+        start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+        page = []
+        for i in xrange(start, len(keys)):
+            if ids is None or keys[i][1] in ids:
+                if len(page) == limit:
+                    return Page([id for key, id in page], page[-1])
+                page.append(keys[i])
+        return Page([id for key, id in page], None)
+
+    def _get_order(self, sort):
+        order = self._orders.get(sort)
+        if order is None:
+            order = self._orders[sort] = sorted(
+                (self._sort_key(id, sort), id)
+                for id in self._ids.itervalues())
+        return order
+
+    def _sort_key(self, id, sort):
+        tags = self._tags[id]
+        key = []
+        for field in sort:
+            value = tags.get(field + 'sortorder')
+            if value is None:
+                value = tags.get(field)
+            if isinstance(value, list):
+                value = value[0] if value else None
+            # Missing values sort last
+            key.append((1, u'') if value is None else (0, _key(value)))
+        return tuple(key)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, path):
+        return path in self._ids
+
+
+def _key(value):
+    return value.lower() if isinstance(value, basestring) else value
+
+
+def _keys(values):
+    if not isinstance(values, list):
+        values = [values]
+    return set(_key(v) for v in values if v is not None)
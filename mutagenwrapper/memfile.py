@@ -0,0 +1,125 @@
+import os
+import stat
+
+
+MFD_CLOEXEC = 1
+
+
+class MemoryFile(object):
+    """A file that can be opened by *path* like any other file, but lives
+    in memory where the platform allows it. On Linux it is an anonymous
+    file created by ``memfd_create()`` and opened through ``/proc``;
+    elsewhere it is a temporary file that is deleted when closed.
+
+    If *fd* is given, the file is not created, but the open file *fd* is
+    referred to by its ``/proc`` path instead. The descriptor is not closed
+    by :meth:`close` in this case.
+    """
+
+    chunk_size = 1 << 20
+
+    #: Whether the file holds only parts of the original file, in which
+    #: case it must not be saved.
+    partial = False
+
+    def __init__(self, fd=None):
+        self._tempfile = None
+        self._owned = fd is None
+        if fd is None:
+            fd = _memfd_create('mutagenwrapper')
+        if fd is None:
+            import tempfile
+            self._tempfile = tempfile.NamedTemporaryFile(dir=_tempdir())
+            self.fd = self._tempfile.fileno()
+            self.path = self._tempfile.name
+        else:
+            self.fd = fd
+            self.path = '/proc/self/fd/{}'.format(fd)
+
+    @classmethod
+    def from_buffer(cls, data):
+        """Returns a new file with the contents of *data*, which is a
+        str, bytearray, memoryview, mmap or any other object that supports
+        the buffer interface.
+        """
+        f = cls()
+        try:
+            # Slices of mmap and buffer objects are copied, as they cannot
+            # be viewed by memoryview in Python 2
+            for start in xrange(0, len(data), cls.chunk_size):
+                _write_all(f.fd, data[start:start + cls.chunk_size])
+        except:
+            f.close()
+            raise
+        return f
+
+    @classmethod
+    def from_fileobj(cls, fileobj):
+        """Returns a file for *fileobj*. If it is a regular file with
+        a descriptor, the file itself is used without copying, so changes are
+        written to it, and it must be kept open. Otherwise its contents from
+        the current position are copied into a new file.
+        """
+        fd = _regular_fileno(fileobj)
+        if fd is not None and os.path.isdir('/proc/self/fd'):
+            return cls(fd)
+        f = cls()
+        try:
+            while True:
+                chunk = fileobj.read(cls.chunk_size)
+                if not chunk:
+                    break
+                _write_all(f.fd, chunk)
+        except:
+            f.close()
+            raise
+        return f
+
+    def close(self):
+        if self.fd is None:
+            return
+        if self._tempfile is not None:
+            self._tempfile.close()
+        elif self._owned:
+            os.close(self.fd)
+        self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+def _memfd_create(name):
+    """Returns the descriptor of a new anonymous file, or *None* if
+    ``memfd_create()`` is not available.
+    """
+    if not os.path.isdir('/proc/self/fd'):
+        return None
+    # Imported here to keep importing the package cheap
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        memfd_create = libc.memfd_create
+    except (OSError, AttributeError):
+        return None
+    fd = memfd_create(name, MFD_CLOEXEC)
+    return fd if fd >= 0 else None
+
+
+def _tempdir():
+    # Prefer a file system in memory
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def _regular_fileno(fileobj):
+    try:
+        fd = fileobj.fileno()
+        return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while len(view):
+        view = view[os.write(fd, view):]
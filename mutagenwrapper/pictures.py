@@ -0,0 +1,245 @@
+import hashlib
+import mmap
+import struct
+
+
+class Picture(str):
+    """An embedded picture that can be assigned to the ``picture`` tag of
+    any format. It is the image data itself, so it compares equal to the
+    data, with the metadata as attributes.
+
+    The frame that a format stores the picture in is built the first time
+    the picture is assigned to a file in that format, and reused for every
+    other file, so the same picture is encoded only once.
+
+    .. attribute:: type
+
+       The picture type as defined by ID3v2 APIC frames, e.g. 3 for
+       the front cover
+
+    """
+
+    def __new__(cls, data, mime=None, type=3, description=u'', width=None,
+                height=None):
+        return str.__new__(cls, data)
+
+    def __init__(self, data, mime=None, type=3, description=u'', width=None,
+                 height=None):
+        self.type = type
+        self.description = description
+        self._mime = mime or None
+        self._size = (width, height) if width and height else None
+        self._frames = {}
+        self._digest = None
+
+    @classmethod
+    def from_ref(cls, ref):
+        """Returns a picture with the data and metadata of
+        :class:`PictureRef` *ref*.
+        """
+        return cls(ref.read(), mime=ref._mime, type=ref.type,
+                   description=ref.description)
+
+    @classmethod
+    def coerce(cls, value):
+        """Returns *value* if it is a picture, or a picture of *value*,
+        which is a :class:`PictureRef` or the image data.
+        """
+        if isinstance(value, cls):
+            return value
+        elif isinstance(value, PictureRef):
+            return cls.from_ref(value)
+        return cls(value)
+
+    @property
+    def mime(self):
+        """The MIME type of the image."""
+        if self._mime is None:
+            self._mime = sniff_mime(self[:16])
+        return self._mime
+
+    @property
+    def width(self):
+        return self._get_size()[0]
+
+    @property
+    def height(self):
+        return self._get_size()[1]
+
+    def digest(self):
+        """Returns the SHA-1 hex digest of the image data."""
+        if self._digest is None:
+            self._digest = hashlib.sha1(self).hexdigest()
+        return self._digest
+
+    def get_frame(self, key, build):
+        """Returns the frame of the picture for *key*, calling
+        *build(picture)* to build it only the first time.
+        """
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = build(self)
+        return frame
+
+    def _get_size(self):
+        if self._size is None:
+            read_at = lambda offset, length: self[offset:offset + length]
+            self._size = image_size(read_at) or (None, None)
+        return self._size
+
+    def __eq__(self, other):
+        if isinstance(other, Picture):
+            return (str.__eq__(self, other) and
+                    (self.mime, self.type, self.description) ==
+                    (other.mime, other.type, other.description))
+        return str.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = str.__hash__
+
+    def __getstate__(self):
+        # Frames are rebuilt rather than sent to other processes
+        state = self.__dict__.copy()
+        state['_frames'] = {}
+        return state
+
+    def __repr__(self):
+        return '<{} {} ({} bytes)>'.format(self.__class__.__name__,
+                                           self.mime, len(self))
+
+
+class PictureRef(object):
+    """A reference to an embedded picture that reads the image data only
+    when asked. Pictures stored in a way that cannot be addressed directly
+    in the file, e.g. inside an unsynchronized ID3 tag, are kept in memory
+    and have no *offset*.
+
+    .. attribute:: offset
+
+       The position of the image data in the file
+
+    .. attribute:: length
+
+       The size of the image data in bytes
+
+    .. attribute:: type
+
+       The picture type as defined by ID3v2 APIC frames, e.g. 3 for
+       the front cover
+
+    """
+
+    def __init__(self, path, offset, length, mime=None, type=3,
+                 description=u'', width=None, height=None, data=None):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.type = type
+        self.description = description
+        self._mime = mime or None
+        self._size = (width, height) if width and height else None
+        self._data = data
+
+    @classmethod
+    def from_data(cls, data, **kwargs):
+        """Returns a reference to *data* that is already in memory."""
+        return cls(None, None, len(data), data=data, **kwargs)
+
+    @property
+    def mime(self):
+        """The MIME type of the image."""
+        if self._mime is None:
+            self._mime = sniff_mime(self.read_at(0, 16))
+        return self._mime
+
+    @property
+    def width(self):
+        return self._get_size()[0]
+
+    @property
+    def height(self):
+        return self._get_size()[1]
+
+    def read(self):
+        """Reads and returns the image data."""
+        return self.read_at(0, self.length)
+
+    def read_at(self, offset, length):
+        """Reads at most *length* bytes of the image data from *offset*."""
+        length = max(0, min(length, self.length - offset))
+        if self._data is not None:
+            return self._data[offset:offset + length]
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset + offset)
+            return f.read(length)
+
+    def mmap(self):
+        """Returns a read-only buffer of the image data that is mapped into
+        memory, instead of being read, from the file.
+        """
+        if self._data is not None:
+            return buffer(self._data[:])
+        start = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        with open(self.path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), self.offset + self.length - start,
+                          access=mmap.ACCESS_READ, offset=start)
+        return buffer(m, self.offset - start, self.length)
+
+    def _get_size(self):
+        if self._size is None:
+            self._size = image_size(self.read_at) or (None, None)
+        return self._size
+
+    def __repr__(self):
+        return '<{} {} ({} bytes)>'.format(self.__class__.__name__,
+                                           self.mime, self.length)
+
+
+def sniff_mime(header):
+    """Guesses the MIME type of an image from its first few bytes."""
+    if header.startswith('\xff\xd8'):
+        return 'image/jpeg'
+    elif header.startswith('\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    elif header.startswith(('GIF87a', 'GIF89a')):
+        return 'image/gif'
+    elif header.startswith('BM'):
+        return 'image/bmp'
+
+
+def image_size(read_at):
+    """Returns the (width, height) of an image, reading only its headers
+    with *read_at(offset, length)*, or *None* if the format is unknown.
+    """
+    header = read_at(0, 26)
+    if header.startswith('\x89PNG\r\n\x1a\n') and header[12:16] == 'IHDR':
+        return struct.unpack('>II', header[16:24])
+    elif header.startswith(('GIF87a', 'GIF89a')):
+        return struct.unpack('<HH', header[6:10])
+    elif header.startswith('BM'):
+        width, height = struct.unpack('<ii', header[18:26])
+        return width, abs(height)
+    elif header.startswith('\xff\xd8'):
+        return _jpeg_size(read_at)
+
+
+def _jpeg_size(read_at):
+    # Walk the segments until a start-of-frame marker is found
+    pos = 2
+    while True:
+        segment = read_at(pos, 9)
+        if len(segment) < 4 or segment[0] != '\xff':
+            return None
+        marker = ord(segment[1])
+        if marker == 0xff:
+            pos += 1
+            continue
+        size, = struct.unpack('>H', segment[2:4])
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            if len(segment) < 9:
+                return None
+            height, width = struct.unpack('>HH', segment[5:9])
+            return width, height
+        pos += 2 + size
@@ -0,0 +1,155 @@
+import os
+
+from . import MediaFile, _detect, get_format
+from .exceptions import UnsupportedFormatError
+from .memfile import MemoryFile
+
+
+class ByteSource(object):
+    """Base class of sources of the contents of a file that can be read
+    at any offset, such as an object store that serves range requests.
+    Subclasses implement :meth:`get_size` and :meth:`read_range`.
+
+    .. attribute:: name
+
+       The name of the file, whose extension is used if the format cannot
+       be detected from the contents, or *None*
+
+    .. attribute:: bytes_fetched
+
+       The number of bytes read from the source so far
+
+    .. attribute:: requests
+
+       The number of reads from the source so far
+
+    """
+
+    name = None
+
+    def __init__(self):
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def get_size(self):
+        """Returns the size of the file."""
+        raise NotImplementedError
+
+    def read_range(self, offset, length):
+        """Returns *length* bytes from *offset*, or fewer at the end of
+        the file.
+        """
+        raise NotImplementedError
+
+    def fetch(self, offset, length):
+        """Reads a range with :meth:`read_range`, counting the bytes."""
+        data = self.read_range(offset, length)
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        return data
+
+
+class FileSource(ByteSource):
+    """A source that reads a local file."""
+
+    def __init__(self, path):
+        super(FileSource, self).__init__()
+        self.name = path
+
+    def get_size(self):
+        return os.path.getsize(self.name)
+
+    def read_range(self, offset, length):
+        with open(self.name, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class RangeReader(object):
+    """A read-only file object over a :class:`ByteSource`. The file is read
+    in blocks of *block_size* bytes, and each block is fetched at most once.
+    Adjacent blocks that are not fetched yet are fetched together.
+    """
+
+    def __init__(self, source, block_size=4096):
+        self.source = source
+        self.block_size = block_size
+        self.size = source.get_size()
+        self.blocks = {}
+        self.pos = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.size if size < 0 else min(self.pos + size, self.size)
+        if end <= self.pos:
+            return ''
+        first = self.pos // self.block_size
+        last = (end - 1) // self.block_size
+        self._fetch(first, last)
+        data = ''.join(self.blocks[i] for i in xrange(first, last + 1))
+        start = self.pos - first * self.block_size
+        data = data[start:start + end - self.pos]
+        self.pos = end
+        return data
+
+    def _fetch(self, first, last):
+        i = first
+        while i <= last:
+            if i in self.blocks:
+                i += 1
+                continue
+            j = i
+            while j + 1 <= last and j + 1 not in self.blocks:
+                j += 1
+            offset = i * self.block_size
+            data = self.source.fetch(offset, (j + 1 - i) * self.block_size)
+            for k in xrange(i, j + 1):
+                start = (k - i) * self.block_size
+                self.blocks[k] = data[start:start + self.block_size]
+            i = j + 1
+
+    def write_image(self, fd, size=None):
+        """Writes the fetched blocks at their offsets to the file *fd*,
+        which is extended to *size*, or the size of the source if *None*.
+        The rest of the file is left as a hole.
+        """
+        os.ftruncate(fd, self.size if size is None else size)
+        for i in sorted(self.blocks):
+            os.lseek(fd, i * self.block_size, 0)
+            data = memoryview(self.blocks[i])
+            while len(data):
+                data = data[os.write(fd, data):]
+
+
+def open_source(source, format=None, block_size=4096, **options):
+    """Reads the tags of the file in :class:`ByteSource` *source*, fetching
+    only the parts of the file that hold them, and returns a read-only
+    :class:`~mutagenwrapper.MediaFile`. Only the tags are loaded, as with
+    ``tags_only=True``. *options* are passed to
+    :class:`~mutagenwrapper.MediaFile`. The number of bytes fetched is
+    counted in :attr:`ByteSource.bytes_fetched`.
+    """
+    reader = RangeReader(source, block_size)
+    extension = format.lower() if format else _detect(reader, source.name)
+    if extension is None:
+        raise UnsupportedFormatError
+    reader.seek(0)
+    get_format(extension).fetch_tags(reader, extension)
+    image = MemoryFile()
+    image.partial = True
+    try:
+        reader.write_image(image.fd)
+    except:
+        image.close()
+        raise
+    options['tags_only'] = True
+    return MediaFile._open_memory_file(image, extension, options)
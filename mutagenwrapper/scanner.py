@@ -0,0 +1,81 @@
+import os
+from collections import namedtuple
+from functools import partial
+
+from . import MediaFile, _extensions
+
+
+class ScanResult(namedtuple('ScanResult', ['path', 'tags', 'error'])):
+    """The outcome of reading a single file during a scan. *tags* is a plain
+    dict of tag names and values, or *None* if the file could not be read,
+    in which case *error* holds the exception that was raised.
+    """
+    __slots__ = ()
+
+
+def iter_paths(roots):
+    """Iterates paths of the files under *roots* whose extensions are
+    registered. *roots* may be a single path or a list of paths, and each
+    of them may be either a directory or a file.
+    """
+    if isinstance(roots, basestring):
+        roots = [roots]
+    for root in roots:
+        if not os.path.isdir(root):
+            if _is_candidate(root):
+                yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if _is_candidate(filename):
+                    yield os.path.join(dirpath, filename)
+
+
+def read_tags(path, **options):
+    """Returns the tags in the file as a plain dict. *options* are passed
+    to :class:`~mutagenwrapper.MediaFile`.
+    """
+    return dict(MediaFile(path, **options).wrapper.iteritems())
+
+
+def scan(roots, workers=None, chunksize=16, **options):
+    """Reads the tags of every supported file under *roots* and yields
+    a :class:`ScanResult` for each file as soon as it is read. The order of
+    the results is not defined.
+
+    Files are read in a pool of *workers* processes, which defaults to the
+    number of CPUs. If *workers* is 1, files are read in the current process.
+    Errors raised while reading a file, such as
+    :exc:`~mutagenwrapper.UnsupportedFormatError`, are reported in the
+    result instead of stopping the scan.
+
+    *options* are passed to :class:`~mutagenwrapper.MediaFile`, e.g.
+    ``tags_only=True``.
+    """
+    paths = iter_paths(roots)
+    func = partial(_scan_one, **options)
+    if workers == 1:
+        for path in paths:
+            yield func(path)
+        return
+    # Imported here to keep importing the package cheap
+    from multiprocessing import Pool
+    pool = Pool(workers)
+    try:
+        for result in pool.imap_unordered(func, paths, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _is_candidate(path):
+    return path.rsplit('.', 1)[-1].lower() in _extensions
+
+
+def _scan_one(path, **options):
+    try:
+        return ScanResult(path, read_tags(path, **options), None)
+    except Exception as e:
+        return ScanResult(path, None, e)
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+
+class Event(namedtuple('Event', ['op', 'format', 'extension', 'path',
+                                 'seconds', 'bytes_read', 'bytes_written'])):
+    """A measured operation, passed to the callback of :func:`enable_stats`.
+    *op* is one of ``'open'``, ``'reload'``, ``'save'`` and ``'decode'``.
+    The byte counts are *None* if they are not measured for the operation
+    or not available on the platform.
+    """
+    __slots__ = ()
+
+
+class OpStats(namedtuple('OpStats', ['count', 'seconds', 'bytes_read',
+                                     'bytes_written'])):
+    """The totals of the operations of a kind on files of a format."""
+    __slots__ = ()
+
+
+class SlowFile(namedtuple('SlowFile', ['path', 'op', 'seconds'])):
+    __slots__ = ()
+
+
+class Recorder(object):
+    """Accumulates :class:`Event` totals keyed by (op, format, extension)
+    and keeps the last *max_slow_files* files that took longer than
+    *slow_threshold* seconds.
+    """
+
+    max_slow_files = 1000
+
+    def __init__(self, slow_threshold=None, callback=None):
+        self.slow_threshold = slow_threshold
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+            self.slow_files = deque(maxlen=self.max_slow_files)
+
+    def record(self, event):
+        key = (event.op, event.format, event.extension)
+        with self.lock:
+            count, seconds, read, written = self.totals.get(key, (0, 0, 0, 0))
+            self.totals[key] = OpStats(count + 1, seconds + event.seconds,
+                                       read + (event.bytes_read or 0),
+                                       written + (event.bytes_written or 0))
+            if (self.slow_threshold is not None and event.op != 'decode' and
+                    event.seconds >= self.slow_threshold):
+                self.slow_files.append(SlowFile(event.path, event.op,
+                                                event.seconds))
+        if self.callback is not None:
+            self.callback(event)
+
+
+class Measurement(object):
+    """A context manager that records an :class:`Event` for the code it
+    wraps. I/O is counted only if *io* is *True*.
+    """
+
+    def __init__(self, recorder, op, format, extension, path, io=True):
+        self.recorder = recorder
+        self.op = op
+        self.format = format
+        self.extension = extension
+        self.path = path
+        self.io = io
+
+    def __enter__(self):
+        self.io_start = read_io_counters() if self.io else None
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.start
+        bytes_read = bytes_written = None
+        if self.io_start is not None:
+            io_end = read_io_counters()
+            if io_end is not None:
+                # The first read of the counters counts itself
+                bytes_read = io_end[0] - self.io_start[0] - self.io_start[2]
+                bytes_written = io_end[1] - self.io_start[1]
+        name = getattr(self.format, 'name', self.format)
+        self.recorder.record(Event(self.op, name, self.extension, self.path,
+                                   seconds, bytes_read, bytes_written))
+
+
+class NullMeasurement(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null = NullMeasurement()
+_recorder = None
+
+
+def stats_enabled():
+    """Returns whether stats are enabled."""
+    return _recorder is not None
+
+
+def measure(op, format, extension, path, io=True):
+    """Returns a context manager that measures an operation if stats are
+    enabled.
+    """
+    if _recorder is None:
+        return _null
+    return Measurement(_recorder, op, format, extension, path, io)
+
+
+def enable_stats(enable=True, slow_threshold=None, callback=None):
+    """Enable or disable collecting stats, which is disabled by default.
+    Files that take *slow_threshold* seconds or longer to open, reload
+    or save are listed in :func:`slow_files`, and *callback* is called with
+    an :class:`Event` for each operation. Enabling stats again resets them.
+
+    Bytes read and written are taken from the I/O counters of the thread
+    in ``/proc``, and are not counted on other platforms. Stats are kept
+    per process, so files read by the worker processes of
+    :func:`~mutagenwrapper.scan` are not counted.
+    """
+    global _recorder
+    _recorder = Recorder(slow_threshold, callback) if enable else None
+
+
+def stats():
+    """Returns a dict that maps (op, format name, extension) to
+    :class:`OpStats`. *op* is ``'open'``, ``'reload'``, ``'save'`` or
+    ``'decode'``, where decoding is reading a tag from a
+    :class:`~mutagenwrapper.MediaFile`. The number of files opened is
+    the count of ``'open'``.
+    """
+    if _recorder is None:
+        return {}
+    with _recorder.lock:
+        return dict(_recorder.totals)
+
+
+def slow_files():
+    """Returns a list of :class:`SlowFile` for the files that were slower
+    than the threshold given to :func:`enable_stats`, oldest first.
+    """
+    if _recorder is None:
+        return []
+    with _recorder.lock:
+        return list(_recorder.slow_files)
+
+
+def reset_stats():
+    if _recorder is not None:
+        _recorder.reset()
+
+
+def read_io_counters():
+    """Returns (bytes read, bytes written, size of the counters) of
+    the current thread, or *None* if not available.
+    """
+    for path in ('/proc/thread-self/io', '/proc/self/io'):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            continue
+        counters = {}
+        for line in data.splitlines():
+            name, _, value = line.partition(':')
+            counters[name] = value
+        try:
+            return int(counters['rchar']), int(counters['wchar']), len(data)
+        except (KeyError, ValueError):
+            return None
+    return None
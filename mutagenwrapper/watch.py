@@ -0,0 +1,290 @@
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from .index import _is_under, _stat_signature
+from .scanner import _is_candidate, iter_paths, read_tags
+
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE)
+
+
+class WatchEvent(namedtuple('WatchEvent', ['path', 'kind', 'tags', 'error'])):
+    """A change to a file found by a :class:`Watcher`. *kind* is
+    ``'changed'`` for a file that was created, written or moved in, in which
+    case *tags* is a plain dict of its tags, or *error* is the exception
+    raised while reading it. *kind* is ``'removed'`` for a file that was
+    deleted or moved away, or a directory, in which case all the files
+    under it are gone.
+    """
+    __slots__ = ()
+
+
+class Watcher(object):
+    """Watches the files under *roots*, which may be a single path or a list
+    of paths, and reads the tags of the files with registered extensions
+    that change. Files are watched with inotify on Linux, and otherwise, or
+    if *polling* is *True*, by comparing their size, modification time and
+    inode number every *interval* seconds.
+
+    A file is read once it has not changed for *debounce* seconds, so a
+    burst of changes, such as a tagger saving a file several times, gives
+    a single event. *options* are passed to
+    :class:`~mutagenwrapper.MediaFile`.
+    """
+
+    def __init__(self, roots, debounce=0.5, interval=5.0, polling=False,
+                 **options):
+        if isinstance(roots, basestring):
+            roots = [roots]
+        roots = [os.path.abspath(root) for root in roots]
+        self.debounce = debounce
+        self.options = options
+        self.backend = None if polling else _InotifyBackend.create(roots)
+        if self.backend is None:
+            self.backend = _PollingBackend(roots, interval)
+        self._pending = {}
+
+    def read(self, timeout=None):
+        """Waits for changes until some files are due to be read or
+        *timeout* seconds have passed, and returns a list of
+        :class:`WatchEvent` for them, which is empty on timeout.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            ready = sorted(path for path, due in self._pending.iteritems()
+                           if due <= now)
+            if ready:
+                for path in ready:
+                    del self._pending[path]
+                return [self._read(path) for path in ready]
+            if end is not None and now >= end:
+                return []
+            waits = [due - now for due in self._pending.itervalues()]
+            if end is not None:
+                waits.append(end - now)
+            wait = min(waits) if waits else None
+            for path in self.backend.wait(wait):
+                self._pending[path] = time.time() + self.debounce
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return WatchEvent(path, 'removed', None, None)
+        try:
+            return WatchEvent(path, 'changed',
+                              read_tags(path, **self.options), None)
+        except Exception as e:
+            return WatchEvent(path, 'changed', None, e)
+
+    def close(self):
+        self.backend.close()
+
+    def __iter__(self):
+        while True:
+            for event in self.read():
+                yield event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _PollingBackend(object):
+    """Finds the files under *roots* that have changed by listing them
+    every *interval* seconds.
+    """
+
+    def __init__(self, roots, interval):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+        self.next_poll = time.time() + interval
+
+    def wait(self, timeout):
+        """Returns a list of the paths that have changed, waiting at most
+        *timeout* seconds, or forever if *None*, for any to change.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            if now >= self.next_poll:
+                self.next_poll = now + self.interval
+                snapshot = self._take_snapshot()
+                changed = [path for path, signature in snapshot.iteritems()
+                           if self.snapshot.get(path) != signature]
+                changed.extend(path for path in self.snapshot
+                               if path not in snapshot)
+                self.snapshot = snapshot
+                if changed:
+                    return changed
+            if end is not None and now >= end:
+                return []
+            wait = self.next_poll - now
+            if end is not None:
+                wait = min(wait, end - now)
+            time.sleep(max(0, wait))
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for path in iter_paths(self.roots):
+            try:
+                snapshot[path] = _stat_signature(path)
+            except OSError:
+                pass
+        return snapshot
+
+    def close(self):
+        pass
+
+
+class _InotifyBackend(object):
+    """Finds the files under *roots* that have changed with inotify, which
+    watches every directory under them.
+    """
+
+    def __init__(self, libc, fd, roots):
+        self.libc = libc
+        self.fd = fd
+        self.dirs = [root for root in roots if os.path.isdir(root)]
+        self.files = set(root for root in roots if not os.path.isdir(root))
+        self.watches = {}
+        for root in self.dirs:
+            self._add_tree(root)
+        for path in self.files:
+            self._add_watch(os.path.dirname(path))
+
+    @classmethod
+    def create(cls, roots):
+        """Returns a backend for *roots*, or *None* if inotify is not
+        available or cannot watch all the directories.
+        """
+        if not hasattr(select, 'select') or not os.path.isdir('/proc'):
+            return None
+        # Imported here to keep importing the package cheap
+        import ctypes
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                               ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError):
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        try:
+            return cls(libc, fd, roots)
+        except OSError:
+            # e.g. the limit of watches has been reached
+            os.close(fd)
+            return None
+
+    def wait(self, timeout):
+        """Returns a list of the paths that have changed, waiting at most
+        *timeout* seconds, or forever if *None*, for any to change.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        changed = []
+        pos = 0
+        while pos + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack('iIII',
+                                                     data[pos:pos + 16])
+            name = data[pos + 16:pos + 16 + length].rstrip('\0')
+            pos += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so every file may have changed
+                for root in self.dirs:
+                    self._add_tree(root)
+                changed.extend(iter_paths(self.dirs + list(self.files)))
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            path = _join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if _is_under(path, self.dirs):
+                        self._add_tree(path)
+                        changed.extend(iter_paths(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove_tree(path)
+                    changed.append(path)
+            elif _is_candidate(name) and (path in self.files or
+                                          _is_under(path, self.dirs)):
+                changed.append(path)
+        return changed
+
+    def _add_tree(self, root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            self._add_watch(dirpath)
+
+    def _add_watch(self, path):
+        encoded = path
+        if isinstance(encoded, unicode):
+            encoded = encoded.encode(sys.getfilesystemencoding() or 'utf-8')
+        wd = self.libc.inotify_add_watch(self.fd, encoded, WATCH_MASK)
+        if wd < 0:
+            # Imported here to keep importing the package cheap
+            import ctypes
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                # The directory is already gone
+                return
+            raise OSError(e, os.strerror(e), path)
+        self.watches[wd] = path
+
+    def _remove_tree(self, root):
+        # Watches of directories moved away would report wrong paths
+        for wd, path in self.watches.items():
+            if _is_under(path, [root]):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _join(directory, name):
+    # inotify gives names as bytes, which are decoded for unicode roots as
+    # os.listdir() would, leaving names that cannot be decoded as bytes
+    if isinstance(directory, unicode):
+        encoding = sys.getfilesystemencoding() or 'utf-8'
+        try:
+            name = name.decode(encoding)
+        except UnicodeDecodeError:
+            directory = directory.encode(encoding)
+    return os.path.join(directory, name)
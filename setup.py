@@ -37,4 +37,10 @@ setup(
     install_requires = [
         'mutagen == 1.24',
     ],
+    extras_require = {
+        'aio': ['trollius'],
+    },
+    entry_points = {
+        'console_scripts': ['mutagenwrapper = mutagenwrapper.cli:main'],
+    },
 )
@@ -1,4 +1,5 @@
 from os import path
+import shutil
 import tempfile
 
 import pytest
@@ -36,6 +37,16 @@ def tempcopy():
     return func
 
 
+@pytest.fixture
+def library(tmpdir):
+    for base in bases:
+        sub = tmpdir.ensure_dir(base.rsplit('.', 1)[-1])
+        shutil.copy(data_dir('1_basic_' + base), str(sub))
+    shutil.copy(data_dir('pcm.wav'), str(tmpdir))
+    tmpdir.join('broken.mp3').write('not an mp3 file')
+    return tmpdir
+
+
 @pytest.yield_fixture
 def with_case_insensitive_enabled():
     enable_case_insensitive(True)
@@ -0,0 +1,73 @@
+import pytest
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = pytest.importorskip('trollius')
+
+from mutagenwrapper import aio
+from conftest import bases
+
+
+def run(future):
+    return asyncio.get_event_loop().run_until_complete(future)
+
+
+def test_open_media_and_save(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = run(aio.open_media(tf.name))
+        assert m.artist == 'Daft Punk'
+        m.artist = 'DAFT PUNK'
+        assert run(m.save()).written
+        run(m.reload())
+        assert m.artist == 'DAFT PUNK'
+        m = run(aio.open_media(tf.name, tags_only=True))
+        assert m['artist'] == 'DAFT PUNK'
+
+
+def test_open_media_error(library):
+    with pytest.raises(Exception):
+        run(aio.open_media(str(library.join('broken.mp3'))))
+
+
+@pytest.mark.parametrize('limit', [1, 2, 16])
+def test_scan(library, limit):
+    it = aio.scan(str(library), limit=limit,
+                  runner=aio.Runner(limit=limit))
+    results = []
+    while True:
+        try:
+            results.append(run(it.next()))
+        except (StopIteration, aio._StopAsyncIteration):
+            break
+    assert len(results) == len(bases) + 1
+    assert sum(1 for r in results if r.error is None) == len(bases)
+
+
+def test_runner_new_loop(path_basic):
+    # The default runner is shared by the event loops
+    run(aio.open_media(path_basic))
+    old = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        futures = [aio.open_media(path_basic) for i in range(6)]
+        results = loop.run_until_complete(asyncio.wait_for(
+            asyncio.gather(*futures, loop=loop), 10, loop=loop))
+        assert [m.artist for m in results] == ['Daft Punk'] * 6
+    finally:
+        asyncio.set_event_loop(old)
+        loop.close()
+
+
+def test_runner_devices(tmpdir):
+    runner = aio.Runner()
+    runner.cache_size = 2
+    for name in 'abc':
+        path = str(tmpdir.join(name).ensure(dir=True).join('x'))
+        assert run(runner.run(path, len, 'x')) == 1
+    assert runner._devices.keys() == [str(tmpdir.join('b')),
+                                      str(tmpdir.join('c'))]
+    # Directories that cannot be read are not remembered
+    assert run(runner.run('/nonexistent/x', len, 'x')) == 1
+    assert len(runner._devices) == 2
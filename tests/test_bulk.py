@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+
+from mutagenwrapper import MediaFile, apply_changes
+from conftest import bases, data_dir
+
+
+def copy(path, tmpdir):
+    target = str(tmpdir.join(os.path.basename(path)))
+    shutil.copy(path, target)
+    return target
+
+
+def read_journal(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_apply_changes(path_basic, tmpdir):
+    path = copy(path_basic, tmpdir)
+    result = apply_changes([(path, {'album': u'Bulk', 'title': None})],
+                           workers=1)
+    assert result == (1, 0, 0, {})
+    m = MediaFile(path)
+    assert m.album == u'Bulk'
+    assert m.title is None
+    assert m.artist == MediaFile(path_basic).artist
+    result = apply_changes([(path, {'album': u'Bulk'})], workers=1)
+    assert result == (0, 1, 0, {})
+
+
+def test_in_place_and_rewrite(path_basic, tmpdir):
+    path = copy(path_basic, tmpdir)
+    journal = str(tmpdir.join('journal'))
+    apply_changes([(path, {'album': u'Small'})], journal, workers=1)
+    apply_changes([(path, {'composer': u'x' * 100000})], journal, workers=1)
+    entries = [e for e in read_journal(journal) if 'key' in e]
+    assert [e['written'] for e in entries] == [True, True]
+    # Ogg files are always rewritten
+    assert [e['in_place'] for e in entries] == [
+        not path.endswith('.ogg'), False]
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        [os.path.basename(path), 'journal'])
+    m = MediaFile(path)
+    assert m.album == u'Small'
+    assert m.composer == u'x' * 100000
+
+
+def test_rewrite_keeps_mode(tmpdir):
+    path = copy(data_dir('1_basic_flac.flac'), tmpdir)
+    os.chmod(path, 0o640)
+    apply_changes([(path, {'composer': u'x' * 100000})], workers=1)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_resume(tmpdir):
+    paths = [copy(data_dir('1_basic_' + base), tmpdir) for base in bases]
+    broken = str(tmpdir.join('broken.mp3'))
+    with open(broken, 'w') as f:
+        f.write('not an mp3 file')
+    journal = str(tmpdir.join('journal'))
+    changes = [(p, {'album': u'Resumed'}) for p in paths + [broken]]
+    result = apply_changes(changes[:2], journal, workers=1, batch_size=1)
+    assert result == (2, 0, 0, {})
+    # An incomplete line left by a crash is ignored
+    with open(journal, 'a') as f:
+        f.write('{"key": ')
+    result = apply_changes(changes, journal, workers=2, batch_size=2)
+    assert result.written == 2
+    assert result.skipped == 2
+    assert list(result.errors) == [broken]
+    # The failed change is retried
+    result = apply_changes(changes, journal, workers=1)
+    assert result.skipped == 4
+    assert list(result.errors) == [broken]
+    for p in paths:
+        assert MediaFile(p).album == u'Resumed'
+
+
+def test_stale_temps_removed(tmpdir):
+    path = copy(data_dir('1_basic_flac.flac'), tmpdir)
+    journal = str(tmpdir.join('journal'))
+    name = os.path.basename(path)
+    stale = tmpdir.join('.{}.abc123.tmp'.format(name))
+    stale.write('left by a crash')
+    other = tmpdir.join('.{}.def456.tmp'.format(name))
+    other.write('not recorded in the journal')
+    with open(journal, 'w') as f:
+        f.write(json.dumps({'temp': str(stale)}) + '\n')
+    apply_changes([(path, {'composer': u'x' * 100000})], journal, workers=1)
+    assert not stale.check()
+    assert other.check()
+    # The temporary file of the rewrite is recorded, and renamed
+    temps = [e['temp'] for e in read_journal(journal) if 'key' not in e]
+    assert len(temps) == 2
+    assert not os.path.exists(temps[1])
+    assert MediaFile(path).composer == u'x' * 100000
+
+
+def test_duplicate_paths(path_basic, tmpdir):
+    path = copy(path_basic, tmpdir)
+    changes = [(path, {'album': u'First'}), (path, {'album': u'Second'})]
+    result = apply_changes(changes, workers=2)
+    assert result.written == 1
+    assert list(result.errors) == [path]
+    assert MediaFile(path).album == u'First'
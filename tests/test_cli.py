@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from mutagenwrapper import MediaFile
+from mutagenwrapper.cli import main
+
+
+def read_lines(capsys):
+    out, err = capsys.readouterr()
+    return [json.loads(line) for line in out.splitlines()]
+
+
+@pytest.mark.parametrize('command', [['dump'], ['scan', '-j', '2']])
+def test_read(library, capsys, command):
+    assert main(command + [str(library)]) == 1
+    results = dict((r['path'], r) for r in read_lines(capsys))
+    assert len(results) == 5
+    assert 'error' in results[str(library.join('broken.mp3'))]
+    path = str(library.join('m4a', '1_basic_alac.m4a'))
+    assert results[path]['tags']['artist'] == 'Daft Punk'
+
+
+def test_read_ext_and_fields(library, capsys):
+    assert main(['scan', '-j', '1', '--ext', 'flac', '--field', 'title',
+                 str(library)]) == 0
+    assert read_lines(capsys) == [{
+        'path': str(library.join('flac', '1_basic_flac.flac')),
+        'tags': {'title': 'Get Lucky'},
+    }]
+
+
+def test_set(library, capsys):
+    path = str(library.join('mp3', '1_basic_lame.mp3'))
+    assert main(['set', '-j', '1', '-t', 'artist=Foo', '-t', 'genre=A',
+                 '-t', 'genre=B', '-t', 'tracknumber=3', '-d', 'album',
+                 path]) == 0
+    assert read_lines(capsys) == [
+        {'path': path, 'written': True, 'in_place': True}]
+    m = MediaFile(path)
+    assert m.artist == 'Foo'
+    assert m.genre == ['A', 'B']
+    assert m.tracknumber == 3
+    assert m.album is None
+
+
+def test_pprint(library, capsys):
+    assert main(['pprint', str(library.join('ogg'))]) == 0
+    out, err = capsys.readouterr()
+    assert 'Get Lucky' in out
+
+
+@pytest.mark.parametrize('tag', ['tracknumber=x', 'artist'])
+def test_set_invalid(library, capsys, tag):
+    path = str(library.join('mp3', '1_basic_lame.mp3'))
+    with pytest.raises(SystemExit) as e:
+        main(['set', '-t', tag, path])
+    assert e.value.code == 2
+    out, err = capsys.readouterr()
+    assert tag in err
@@ -0,0 +1,60 @@
+import shutil
+
+import pytest
+
+from mutagenwrapper import MediaFile, extract_columns
+from mutagenwrapper.columns import IntColumn, StringColumn
+from conftest import bases, data_dir
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_extract_columns(workers):
+    paths = [data_dir('1_basic_' + base) for base in bases] * 2
+    paths.append(data_dir('pcm.wav'))
+    fields = ['artist', 'tracknumber', 'disctotal', 'comment', '___missing']
+    table = extract_columns(paths, fields, workers=workers)
+    assert table.paths == paths
+    assert table.errors.keys() == [data_dir('pcm.wav')]
+    artist = table.columns['artist']
+    assert isinstance(artist, StringColumn)
+    assert list(artist) == [u'Daft Punk'] * 8 + [None]
+    assert artist.dictionary == [u'Daft Punk']
+    assert list(artist.mask) == [1] * 8 + [0]
+    tracknumber = table.columns['tracknumber']
+    assert isinstance(tracknumber, IntColumn)
+    assert tracknumber.values.tolist() == [8] * 8 + [0]
+    assert list(tracknumber) == [8] * 8 + [None]
+    assert list(table.columns['disctotal']) == [1] * 8 + [None]
+    assert list(table.columns['___missing']) == [None] * 9
+
+
+def test_extract_columns_picture():
+    with pytest.raises(ValueError):
+        extract_columns([], ['picture'])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_extract_columns_malformed(workers, tmpdir):
+    path = str(tmpdir.join('malformed.flac'))
+    shutil.copy(data_dir('1_basic_flac.flac'), path)
+    m = MediaFile(path)
+    m.raw['tracknumber'] = [u'5/12']
+    m.raw.save()
+    paths = [path, data_dir('1_basic_flac.flac')]
+    table = extract_columns(paths, ['artist', 'tracknumber'], workers=workers)
+    assert table.errors.keys() == [path]
+    assert list(table.columns['artist']) == [None, u'Daft Punk']
+    assert list(table.columns['tracknumber']) == [None, 8]
+
+
+def test_extract_columns_overflow(tmpdir):
+    path = str(tmpdir.join('overflow.mp3'))
+    shutil.copy(data_dir('1_basic_lame.mp3'), path)
+    m = MediaFile(path)
+    m.tracknumber = 99999999999999999999
+    m.save()
+    paths = [path, data_dir('1_basic_lame.mp3')]
+    table = extract_columns(paths, ['artist', 'tracknumber'], workers=1)
+    assert table.errors == {}
+    assert list(table.columns['artist']) == [u'Daft Punk'] * 2
+    assert list(table.columns['tracknumber']) == [None, 8]
@@ -0,0 +1,39 @@
+import os
+
+from mutagenwrapper import LibraryIndex, MediaFile
+
+
+def test_library_index(library, tmpdir):
+    root = str(library)
+    with LibraryIndex(str(tmpdir.join('index.db'))) as index:
+        r = index.update(root, workers=1)
+        assert r.updated == 5
+        assert r.failed == 1
+        assert r.unchanged == r.removed == 0
+        path = str(library.join('mp3', '1_basic_lame.mp3'))
+        assert index.get(path)['artist'] == 'Daft Punk'
+        assert index.error(str(library.join('broken.mp3')))
+
+        r = index.update(root, workers=1)
+        assert r.updated == 0
+        assert r.unchanged == 5
+
+        m = MediaFile(path)
+        m.artist = 'DAFT PUNK'
+        m.save()
+        os.remove(str(library.join('flac', '1_basic_flac.flac')))
+        r = index.update(root, workers=1)
+        assert r.updated == 1
+        assert r.unchanged == 3
+        assert r.removed == 1
+        assert index.get(path)['artist'] == 'DAFT PUNK'
+        assert len(index) == 4
+
+
+def test_library_index_persistent(library, tmpdir):
+    db = str(tmpdir.join('index.db'))
+    with LibraryIndex(db) as index:
+        index.update(str(library), workers=1)
+    with LibraryIndex(db) as index:
+        assert len(list(index.iteritems())) == 4
+        assert index.update(str(library), workers=1).updated == 0
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import time
+
+from mutagenwrapper import Library, LibraryIndex
+
+
+def make_tracks():
+    tracks = []
+    for i in xrange(200):
+        tags = {
+            'artist': [u'Artist {}'.format(i % 10)],
+            'album': u'Album {}'.format(i % 20),
+            'genre': [u'Rock', u'Pop'] if i % 2 else u'Jazz',
+            'tracknumber': i % 13,
+        }
+        if i % 10 == 3:
+            tags['artistsortorder'] = u'A3'
+        tracks.append(('/music/{:03}.flac'.format(i), tags))
+    return tracks
+
+
+def test_find():
+    library = Library(make_tracks())
+    assert len(library) == 200
+    ids = library.find(artist=u'artist 1', genre=u'ROCK')
+    assert [library.path(i) for i in ids] == [
+        '/music/{:03}.flac'.format(i) for i in xrange(1, 200, 10)]
+    assert library.find(artist=u'Artist 2', genre=u'Rock') == []
+    assert library.find(artist=u'Nobody') == []
+    assert library.find(tracknumber=0) == library.find(tracknumber=0)
+    assert len(library.find(tracknumber=0)) == 16
+    assert len(library.find()) == 200
+    assert library.values('genre') == {u'rock': 100, u'pop': 100,
+                                       u'jazz': 100}
+
+
+def test_add_remove():
+    library = Library(make_tracks())
+    id = library.add('/music/000.flac', {'artist': u'Changed'})
+    assert library.find(artist=u'changed') == [id]
+    assert len(library.find(artist=u'Artist 0')) == 19
+    library.remove('/music/000.flac')
+    assert library.find(artist=u'changed') == []
+    assert '/music/000.flac' not in library
+    assert len(library) == 199
+
+
+def test_orders_updated():
+    library = Library(make_tracks())
+    library.page('artist', 10)
+    order = library._orders[('artist',)]
+    library.add('/music/new.flac', {'artist': u'A0'})
+    library.add('/music/001.flac', {'artist': u'Zed'})
+    library.remove('/music/002.flac')
+    # The sorted tracks are updated instead of being sorted again
+    assert library._orders[('artist',)] is order
+    assert order == sorted((library._sort_key(id, ('artist',)), id)
+                           for id in library.find())
+    ids = library.page('artist', 300).ids
+    assert library.path(ids[0]) == '/music/new.flac'
+    assert library.path(ids[-1]) == '/music/001.flac'
+    assert len(ids) == 200
+
+
+def test_page():
+    library = Library(make_tracks())
+    sort = ('artist', 'album', 'tracknumber')
+    expected = sorted(
+        (library.get(i).get('artistsortorder', library.get(i)['artist'][0])
+         .lower(), library.get(i)['album'].lower(),
+         library.get(i)['tracknumber'], i) for i in library.find(genre=u'pop'))
+    # Sorting the matches and walking the sorted tracks give the same pages
+    for ratio in 0, 1:
+        library.sort_ratio = ratio
+        ids = []
+        cursor = None
+        while True:
+            page = library.page(sort, 7, cursor, genre=u'pop')
+            ids.extend(page.ids)
+            cursor = page.cursor
+            if cursor is None:
+                break
+            assert len(page.ids) == 7
+        assert ids == [key[-1] for key in expected]
+    assert library.path(library.page('artist', 1).ids[0]) == '/music/003.flac'
+    assert library.page('artist', 10, genre=u'none') == ([], None)
+
+
+def test_missing_values_last():
+    library = Library([('a', {'title': u'B'}), ('b', {}),
+                       ('c', {'title': [u'a', u'z']})])
+    ids = library.page('title', 10).ids
+    assert [library.path(i) for i in ids] == ['c', 'a', 'b']
+
+
+def test_from_index(library, tmpdir):
+    with LibraryIndex(str(tmpdir.join('index.db'))) as index:
+        index.update(str(library), workers=1)
+        lib = Library(index.iteritems())
+    assert len(lib) == 4
+    assert len(lib.find(artist=u'daft punk', tracknumber=8)) == 4
+
+
+def test_find_fast():
+    tracks = [('/{}'.format(i), {'artist': u'A{}'.format(i % 1000),
+                                 'genre': u'G{}'.format(i % 7)})
+              for i in xrange(50000)]
+    library = Library(tracks)
+    start = time.time()
+    for i in xrange(100):
+        library.find(artist=u'a{}'.format(i), genre=u'g1')
+    assert (time.time() - start) / 100 < 0.005
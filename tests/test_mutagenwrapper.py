@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
+import base64
+import io
+import os
+import shutil
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+
 import pytest
 
-from mutagenwrapper import MediaFile, ReservedTagNameError
+from mutagenwrapper import (MediaFile, MutagenWrapperError, Picture,
+                            ReservedTagNameError, UnsupportedFormatError,
+                            detect_format, digest, find_pictures,
+                            supported_formats)
+from mutagenwrapper.formats.vorbis import Base64Data, build_vorbis_picture
+from conftest import bases, data_dir
 
 
 basic_ref = {
@@ -112,3 +125,374 @@ def test_basic_write_unicode(path_basic, tempcopy):
 def test_basic_read_picture(path_basic):
     m = MediaFile(path_basic)
     #assert m.picture == ''
+
+
+def test_tags_only_read(path_basic):
+    m = MediaFile(path_basic, tags_only=True)
+    for k in sorted(basic_ref.iterkeys()):
+        assert m[k] == basic_ref[k]
+
+
+def test_tags_only_write(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name, tags_only=True)
+        m.artist = 'DAFT PUNK'
+        m.tracktotal = 42
+        m.save()
+        m = MediaFile(tf.name)
+        assert m.artist == 'DAFT PUNK'
+        assert m.tracknumber == 8
+        assert m.tracktotal == 42
+        assert m.raw.info.length > 0
+
+
+def test_find_pictures(path_basic):
+    with open(data_dir('purple.jpg'), 'rb') as f:
+        data = f.read()
+    refs = find_pictures(path_basic)
+    assert len(refs) == 1
+    ref = refs[0]
+    assert ref.length == len(data)
+    assert ref.mime == 'image/jpeg'
+    assert (ref.width, ref.height) == (100, 100)
+    assert ref.read() == data
+    assert ref.mmap()[:] == data
+    assert MediaFile(path_basic).get_pictures()[0].read() == data
+
+
+def test_write_picture(path_basic, tempcopy):
+    with open(data_dir('purple.png'), 'rb') as f:
+        data = f.read()
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        assert m.picture.mime == 'image/jpeg'
+        m.picture = Picture(data)
+        m.save(reload=True)
+        assert m.picture == data
+        assert m.picture.mime == 'image/png'
+        assert 'picture' in m.keys()
+        assert m.get_pictures()[0].read() == data
+        m.picture = m.get_pictures()[0]
+        assert not m.wrapper.modified
+        del m.picture
+        m.save(reload=True)
+        assert m.picture is None
+
+
+def test_write_picture_description(path_basic, tempcopy):
+    with open(data_dir('purple.png'), 'rb') as f:
+        picture = Picture(f.read(), description=u'Back')
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        del m.picture
+        assert 'picture' not in m
+        m.picture = picture
+        assert 'picture' in m
+        m.save(reload=True)
+        assert 'picture' in m
+        assert dict(m.wrapper.iteritems())['picture'] == str(picture)
+        if m.extension != 'm4a':  # MP4 covers have no description
+            assert m.picture.description == u'Back'
+
+
+def test_write_picture_encoded_once(path_basic, tempcopy):
+    with open(data_dir('purple.png'), 'rb') as f:
+        picture = Picture(f.read(), type=4, description=u'Back')
+    with tempcopy(path_basic) as tf1, tempcopy(path_basic) as tf2:
+        m1, m2 = MediaFile(tf1.name), MediaFile(tf2.name)
+        m1.picture = m2.picture = picture
+        assert len(picture._frames) in (1, 2)  # Ogg also builds a FLAC block
+        frame = picture._frames.values()[0]
+        m1.save()
+        m2.save()
+        for m in MediaFile(tf1.name), MediaFile(tf2.name):
+            assert m.picture == str(picture)
+            if m.extension != 'm4a':  # MP4 covers have no type
+                assert m.picture == picture
+        assert picture._frames.values()[0] is frame
+
+
+def test_ogg_picture_comments(tempcopy):
+    path = data_dir('1_basic_oggvorbis.ogg')
+    with open(data_dir('purple.jpg'), 'rb') as f:
+        data = f.read()
+    m = MediaFile(path)
+    # Kept as base64 bytes until the picture is read
+    value, = m.raw['metadata_block_picture']
+    assert type(value) is str
+    assert 'picture' in m.keys()
+    assert not any('metadata_block_picture' in k for k in m.keys())
+    assert m.picture == data
+    assert m.picture.mime == 'image/jpeg'
+    # Decoded once
+    assert m.picture is m.picture
+    m = MediaFile(path, fields=['artist'])
+    assert 'metadata_block_picture' not in m.raw
+    assert m.artist == 'Daft Punk'
+    with tempcopy(path) as tf:
+        m = MediaFile(tf.name)
+        m.title = u'Kept'
+        m.save(reload=True)
+        assert m.picture == data
+        m.picture = Picture('new')
+        assert m.picture == 'new'
+        m.raw['metadata_block_picture'] = [build_vorbis_picture(
+            Picture(data))]
+        assert m.picture == data
+
+
+def test_base64_data():
+    data = os.urandom(1000)
+    encoded = base64.b64encode(data)
+    for offset in 0, 1, 2, 3, 500:
+        b = Base64Data(encoded, offset)
+        assert len(b) == len(data) - offset
+        assert b[:] == data[offset:]
+        for start in 0, 1, 2, 5, 400:
+            for stop in start, start + 1, start + 2, start + 3, 10000:
+                assert b[start:stop] == data[offset:][start:stop]
+
+
+def test_digest(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        before = digest(tf.name)
+        tag_before = MediaFile(tf.name).tag_digest()
+        assert before == digest(path_basic)
+        # Change a byte of the audio
+        size = os.path.getsize(tf.name)
+        with open(tf.name, 'r+b') as f:
+            f.seek(size - 200)
+            c = f.read(1)
+            f.seek(size - 200)
+            f.write(chr(ord(c) ^ 0xff))
+        assert digest(tf.name) == before
+        m = MediaFile(tf.name)
+        album = m.album
+        m.album = u'Changed'
+        m.save()
+        assert digest(tf.name) != before
+        assert MediaFile(tf.name).tag_digest() != tag_before
+        m.album = album
+        m.save()
+        assert MediaFile(tf.name).tag_digest() == tag_before
+
+
+def test_fields(path_basic, tempcopy):
+    fields = ('artist', 'album', 'tracknumber')
+    m = MediaFile(path_basic, fields=fields)
+    assert sorted(m.keys()) == sorted(fields)
+    assert dict(m.wrapper.iteritems()) == dict((k, basic_ref[k])
+                                               for k in fields)
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name, fields=fields)
+        m.artist = 'DAFT PUNK'
+        with pytest.raises(MutagenWrapperError):
+            m.save()
+    # The ID3v2.3 date frames are upgraded to the ID3v2.4 one
+    m = MediaFile(path_basic, fields=['date'])
+    assert m.date == basic_ref['date']
+
+
+def test_keys(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        assert set(basic_ref).issubset(m.keys())
+        assert len(m) == len(m.keys())
+        del m.artist
+        assert 'artist' not in m
+        m.___custom = 'foo'
+        assert '___custom' in m
+        del m.tracknumber
+        assert 'tracknumber' not in m
+        del m.album
+        assert 'album' not in m
+        m.album = 'Foo'
+        assert 'album' in m
+        assert set(m) == set(m.wrapper.get_tags())
+        m.save(reload=True)
+        assert '___custom' in m
+        assert 'artist' not in m
+
+
+def test_update_and_modified(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        m.update({'artist': basic_ref['artist'], 'tracknumber': 8})
+        assert not m.modified
+        assert not m.save(only_modified=True)
+        m.update([('artist', 'DAFT PUNK'), ('title', basic_ref['title'])])
+        assert m.modified == set(['artist'])
+        assert m.save(reload=True)
+        assert not m.modified
+        assert m.artist == 'DAFT PUNK'
+        del m.date
+        assert m.modified == set(['date'])
+        # Setting tags back to their values when loaded undoes the changes
+        m.date = basic_ref['date']
+        m.artist = u'Someone'
+        m.artist = 'DAFT PUNK'
+        assert not m.modified
+        assert not m.save(only_modified=True)
+        m.artist = u'Someone'
+        m.save()
+        m.artist = 'DAFT PUNK'
+        assert m.modified == set(['artist'])
+        m.save(reload=True)
+        # tracknumber and tracktotal share a tag in some formats
+        del m.tracknumber
+        m.tracknumber = 8
+        total = m.tracktotal
+        if total == basic_ref['tracktotal']:
+            assert not m.modified
+        else:
+            assert m.modified == set(['tracktotal'])
+        m.save(reload=True, only_modified=True)
+        assert (m.tracknumber, m.tracktotal) == (8, total)
+
+
+def test_save_raw(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        key = {'mp3': 'TALB', 'm4a': '\xa9alb'}.get(m.extension, 'album')
+        del m.raw[key]
+        assert not m.modified
+        assert not m.save(only_modified=True)
+        assert m.save(reload=True)
+        assert m.album is None
+
+
+def test_save_padding(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        m.lyrics = 'x' * 20000
+        result = m.save(reload=True, padding=50000)
+        assert result.written and not result.in_place
+        for i in xrange(3):
+            m.lyrics = str(i) * 40000
+            result = m.save(reload=True)
+            assert result.written
+            if m.extension != 'ogg':
+                # Ogg has no padding
+                assert result.in_place
+        assert m.lyrics == '2' * 40000
+
+
+def test_detect_format(path_basic, tmpdir):
+    ext = path_basic.rsplit('.', 1)[-1]
+    assert detect_format(path_basic) == ext
+    for name in ['noext', 'wrong.mp3', 'wrong.m4a', 'UPPER.' + ext.upper()]:
+        path = str(tmpdir.join(name))
+        shutil.copy(path_basic, path)
+        assert detect_format(path) == ext
+        assert MediaFile(path).artist == basic_ref['artist']
+    assert detect_format(data_dir('pcm.wav')) is None
+    with pytest.raises(UnsupportedFormatError):
+        MediaFile(data_dir('pcm.wav'))
+
+
+def test_lazy_formats():
+    code = ('import sys, mutagenwrapper; '
+            'assert not [m for m in sys.modules if m.startswith("mutagen.")]')
+    subprocess.check_call([sys.executable, '-c', code])
+    formats = dict((name, set(exts)) for name, exts in supported_formats())
+    assert formats['MP4'] == set(['m4a', 'm4b', 'm4p', 'm4v', 'mp4'])
+
+
+def test_lazy_formats_threads():
+    # The formats are loaded by the first files opened, so this must run in
+    # a fresh process
+    paths = [data_dir('1_basic_' + base) for base in bases] * 6
+    code = ('import sys, mutagenwrapper\n'
+            'from multiprocessing.pool import ThreadPool\n'
+            'pool = ThreadPool(12)\n'
+            'titles = pool.map(lambda p: mutagenwrapper.MediaFile(p).title,\n'
+            '                  sys.argv[1:])\n'
+            'assert titles == [%r] * len(sys.argv[1:])\n' % basic_ref['title'])
+    subprocess.check_call([sys.executable, '-c', code] + paths)
+
+
+def test_custom_handlers_bounded(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        cls = m.wrapper.__class__
+        cache = cls.__custom_handlers__
+        maxsize = cache.maxsize
+        cache.maxsize = 5
+        try:
+            for i in xrange(20):
+                m['___bounded{}'.format(i)] = u'value {}'.format(i)
+            assert len(cache) <= 5
+            assert not any(k.startswith('___bounded') for k in vars(cls))
+            for i in xrange(20):
+                assert m['___bounded{}'.format(i)] == u'value {}'.format(i)
+            assert m.___missing is None
+        finally:
+            cache.maxsize = maxsize
+
+
+def test_per_instance_options(path_basic, tempcopy):
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name, custom_prefix='x_', case_insensitive=True)
+        m['x_MyTag'] = u'value'
+        m.save()
+        assert m['x_mytag'] == u'value'
+        assert 'x_mytag' in m
+        m = MediaFile(tf.name)
+        assert m.case_insensitive == (m.extension in ('flac', 'ogg'))
+        assert [k for k in m if k.lower() == '___mytag']
+        m = MediaFile(tf.name, custom_prefix='x_', fields=['x_mytag'])
+        assert m['x_mytag'] == u'value'
+
+
+def test_per_instance_options_threads(path_basic):
+    def read(prefix):
+        m = MediaFile(path_basic, custom_prefix=prefix)
+        return sorted(k for k in m if k.startswith(prefix))
+
+    pool = ThreadPool(4)
+    try:
+        results = pool.map(read, ['___', 'y_'] * 20)
+    finally:
+        pool.close()
+    assert results[::2] == [read('___')] * 20
+    assert results[1::2] == [read('y_')] * 20
+    assert [k[3:] for k in read('___')] == [k[2:] for k in read('y_')]
+
+
+def test_from_buffer(path_basic):
+    with open(path_basic, 'rb') as f:
+        data = f.read()
+    for source in [data, bytearray(data), memoryview(data)]:
+        m = MediaFile.from_buffer(source)
+        assert m.artist == basic_ref['artist']
+        m.artist = u'Buffer'
+        m.save()
+        assert MediaFile.from_buffer(m.getbuffer()).artist == u'Buffer'
+        assert MediaFile.from_buffer(m.getvalue()).artist == u'Buffer'
+        m.close()
+    assert open(path_basic, 'rb').read() == data
+
+
+def test_from_fileobj(path_basic, tempcopy):
+    with open(path_basic, 'rb') as f:
+        data = f.read()
+    ext = path_basic.rsplit('.', 1)[-1]
+    m = MediaFile.from_fileobj(io.BytesIO(data), format=ext)
+    assert m.extension == ext
+    assert m.title == basic_ref['title']
+    with tempcopy(path_basic) as tf:
+        m = MediaFile.from_fileobj(tf)
+        m.title = u'Fileobj'
+        m.save()
+        assert MediaFile(tf.name).title == u'Fileobj'
+
+
+def test_from_buffer_without_memfd(path_basic, monkeypatch):
+    monkeypatch.setattr('mutagenwrapper.memfile._memfd_create',
+                        lambda name: None)
+    with open(path_basic, 'rb') as f:
+        m = MediaFile.from_buffer(f.read())
+    assert not m.path.startswith('/proc/')
+    assert m.artist == basic_ref['artist']
+    m.close()
+    assert not os.path.exists(m.path)
@@ -0,0 +1,40 @@
+import os
+import struct
+
+import pytest
+
+from mutagenwrapper import (FileSource, MediaFile, MutagenWrapperError,
+                            UnsupportedFormatError)
+from mutagenwrapper.formats.mp4 import iter_atoms
+from conftest import data_dir
+
+
+def test_from_source(path_basic):
+    source = FileSource(path_basic)
+    m = MediaFile.from_source(source, block_size=512)
+    assert dict(m.iteritems()) == dict(MediaFile(path_basic).iteritems())
+    assert 0 < source.bytes_fetched < os.path.getsize(path_basic)
+    with pytest.raises(MutagenWrapperError):
+        m.save()
+
+
+def test_from_source_moov_at_end(tmpdir):
+    with open(data_dir('1_basic_alac.m4a'), 'rb') as f:
+        data = f.read()
+        atoms = dict((name, data[offset:offset + size]) for name, offset,
+                     header, size in iter_atoms(f, 0, len(data)))
+    # Put a megabyte of stand-in audio before moov
+    free = struct.pack('>I4s', 8 + 2 ** 20, 'free') + '\x00' * 2 ** 20
+    path = str(tmpdir.join('moov_at_end.m4a'))
+    with open(path, 'wb') as f:
+        f.write(atoms['ftyp'] + free + atoms['moov'])
+    source = FileSource(path)
+    m = MediaFile.from_source(source)
+    assert m.artist == 'Daft Punk'
+    assert m.tracknumber == 8
+    assert source.bytes_fetched < 4 * 4096
+
+
+def test_from_source_unsupported():
+    with pytest.raises(UnsupportedFormatError):
+        MediaFile.from_source(FileSource(data_dir('pcm.wav')))
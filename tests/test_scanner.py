@@ -0,0 +1,24 @@
+import pytest
+
+from mutagenwrapper import scan
+from conftest import bases
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan(library, workers):
+    results = dict((r.path, r) for r in scan(str(library), workers=workers))
+    assert len(results) == len(bases) + 1
+    for base in bases:
+        ext = base.rsplit('.', 1)[-1]
+        r = results[str(library.join(ext, '1_basic_' + base))]
+        assert r.error is None
+        assert r.tags['artist'] == 'Daft Punk'
+        assert r.tags['tracknumber'] == 8
+    broken = results[str(library.join('broken.mp3'))]
+    assert broken.tags is None
+    assert broken.error is not None
+
+
+def test_scan_tags_only(library):
+    for r in scan(str(library.join('mp3')), workers=1, tags_only=True):
+        assert r.tags['title'] == 'Get Lucky'
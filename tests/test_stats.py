@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from mutagenwrapper import (MediaFile, enable_stats, reset_stats, slow_files,
+                            stats)
+
+
+@pytest.yield_fixture
+def with_stats_enabled():
+    events = []
+    enable_stats(slow_threshold=0, callback=events.append)
+    yield events
+    enable_stats(False)
+
+
+def test_disabled(path_basic):
+    MediaFile(path_basic).artist
+    assert stats() == {}
+    assert slow_files() == []
+
+
+def test_stats(path_basic, tempcopy, with_stats_enabled):
+    events = with_stats_enabled
+    with tempcopy(path_basic) as tf:
+        m = MediaFile(tf.name)
+        m.artist
+        m['title']
+        # Attributes that are not tags are not decodes
+        m.raw, m.keys, m.modified
+        m.album = u'Stats'
+        m.save(reload=True)
+        ext = m.extension
+        name = m.format.name
+        result = stats()
+        assert result[('open', name, ext)].count == 1
+        assert result[('decode', name, ext)].count == 2
+        assert result[('reload', name, ext)].count == 1
+        save = result[('save', name, ext)]
+        assert save.count == 1
+        assert save.seconds > 0
+        if os.path.exists('/proc/self/io'):
+            assert result[('open', name, ext)].bytes_read > 0
+            assert save.bytes_written > 0
+        assert [e.op for e in events] == ['open', 'decode', 'decode',
+                                          'save', 'reload']
+        assert [(f.path, f.op) for f in slow_files()] == [
+            (tf.name, 'open'), (tf.name, 'save'), (tf.name, 'reload')]
+    reset_stats()
+    assert stats() == {}
+    assert slow_files() == []
+
+
+def test_stats_iteritems(path_basic, with_stats_enabled):
+    m = MediaFile(path_basic)
+    m.tag_digest()
+    result = stats()
+    assert result[('decode', m.format.name, m.extension)].count == len(m)
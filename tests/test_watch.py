@@ -0,0 +1,89 @@
+import os
+import shutil
+
+import pytest
+
+from mutagenwrapper import MediaFile, Watcher
+from mutagenwrapper.watch import _InotifyBackend
+from conftest import data_dir
+
+
+@pytest.fixture(params=['polling', 'inotify'])
+def watch(request, tmpdir):
+    polling = request.param == 'polling'
+    if not polling:
+        backend = _InotifyBackend.create([str(tmpdir)])
+        if backend is None:
+            pytest.skip('inotify is not available')
+        backend.close()
+    watcher = Watcher(str(tmpdir), debounce=0.1, interval=0.02,
+                      polling=polling)
+    request.addfinalizer(watcher.close)
+    if not polling:
+        assert isinstance(watcher.backend, _InotifyBackend)
+    return watcher
+
+
+def read_all(watcher):
+    events = []
+    while True:
+        read = watcher.read(timeout=0.5)
+        if not read:
+            return events
+        events.extend(read)
+
+
+def test_watch_files(watch, tmpdir):
+    source = data_dir('1_basic_flac.flac')
+    path = str(tmpdir.join('a.flac'))
+    shutil.copy(source, path)
+    tmpdir.join('notes.txt').write('ignored')
+    events = read_all(watch)
+    assert [(e.path, e.kind) for e in events] == [(path, 'changed')]
+    assert events[0].tags['title'] == MediaFile(source).title
+
+    # A burst of saves gives one event
+    for album in [u'One', u'Two', u'Three']:
+        m = MediaFile(path)
+        m.album = album
+        m.save()
+    events = read_all(watch)
+    assert len(events) == 1
+    assert events[0].tags['album'] == u'Three'
+
+    os.remove(path)
+    events = read_all(watch)
+    assert [(e.path, e.kind, e.tags) for e in events] == [
+        (path, 'removed', None)]
+
+
+def test_watch_directories(watch, tmpdir):
+    outside = tmpdir.join('..', tmpdir.basename + '-outside').ensure(dir=True)
+    shutil.copy(data_dir('1_basic_lame.mp3'), str(outside.join('a.mp3')))
+    broken = outside.join('b.mp3')
+    broken.write('not an mp3 file')
+    album = str(tmpdir.join('album'))
+    shutil.move(str(outside), album)
+    events = read_all(watch)
+    assert [e.path for e in events] == [os.path.join(album, 'a.mp3'),
+                                        os.path.join(album, 'b.mp3')]
+    assert events[0].tags is not None and events[0].error is None
+    assert events[1].tags is None and events[1].error is not None
+
+    shutil.move(album, str(outside))
+    events = read_all(watch)
+    assert set(e.kind for e in events) == set(['removed'])
+    shutil.rmtree(str(outside))
+
+
+def test_watch_unicode_root(tmpdir):
+    # Roots read from JSON or configuration files are unicode
+    root = unicode(tmpdir.join('unicode').ensure(dir=True))
+    watcher = Watcher(root, debounce=0.1, interval=0.02)
+    try:
+        path = os.path.join(root, u'a.flac')
+        shutil.copy(data_dir('1_basic_flac.flac'), path)
+        events = read_all(watcher)
+        assert [(e.path, e.kind) for e in events] == [(path, 'changed')]
+    finally:
+        watcher.close()